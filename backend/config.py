@@ -5,3 +5,6 @@ load_dotenv()
 
 DATABASE_PATH = os.getenv("DATABASE_PATH", "storage/database.db")
 DATABASE_URL = os.getenv("DATABASE_URL")
+
+# 是否在 API 进程内启动 Worker；单独用 `python -m workers` 跑 Worker 进程时设为 0
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "1").strip().lower() not in ("0", "false", "no", "off")
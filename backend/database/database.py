@@ -16,6 +16,7 @@ from sqlalchemy import (
     ForeignKey,
     JSON,
     UniqueConstraint,
+    Index,
 )
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from config import DATABASE_PATH, DATABASE_URL as ENV_DATABASE_URL
@@ -38,7 +39,8 @@ if DATABASE_URL.startswith("sqlite:///"):
 
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False},
+    # check_same_thread 只对 SQLite 有效，其他数据库（如 PostgreSQL）不接受该参数
+    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
     echo=False,
 )
 
@@ -47,6 +49,9 @@ if DATABASE_URL.startswith("sqlite:///"):
     def _set_sqlite_pragma(dbapi_connection, connection_record):
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        # WAL：API 进程与独立 Worker 进程可以同时读写，写锁冲突时最多等待 busy_timeout 毫秒
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=10000")
         cursor.close()
 
 
@@ -140,6 +145,10 @@ class Character(Base):
 
 class ScriptLine(Base):
     __tablename__ = "script_lines"
+    __table_args__ = (
+        # 过期检测按项目 + 角色过滤已合成的行
+        Index("ix_script_lines_project_character_status", "project_id", "character_id", "status"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     project_id = Column(String, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
@@ -157,6 +166,10 @@ class ScriptLine(Base):
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_status_priority_created", "status", "priority", "created_at"),
+        Index("ix_tasks_project_status_created", "project_id", "status", "created_at"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     project_id = Column(String, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
@@ -166,6 +179,24 @@ class Task(Base):
     result = Column(JSON, nullable=True)
     error_msg = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.now)
+    # 领取任务的 Worker 与租约到期时间，多进程/多节点共享一个库时用于原子领取
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    # 心跳续租时间 + 已领取次数，Worker 崩溃后由回收线程按租约重新排队
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    # 调度优先级，数值越小越先执行，按任务类型分通道（见 workers/task_queue.py）
+    priority = Column(Integer, default=20)
+    # 长任务进度：done/total/percent/current_line_id/items_per_sec/eta_seconds，由 ProgressReporter 批量写入
+    progress = Column(JSON, nullable=True)
+    # 用户请求取消执行中的任务，handler 协作检查后退出
+    cancel_requested = Column(Boolean, default=False)
+    # 暂时性失败后的退避重试：在该时间之前不会被再次领取
+    next_attempt_at = Column(DateTime, nullable=True)
+    # 进入终态（success/failed/cancelled/dead_letter）的时间
+    finished_at = Column(DateTime, nullable=True)
+    # 同类任务的规范化载荷哈希，用于合并重复提交
+    payload_hash = Column(String, nullable=True, index=True)
 
     project = relationship("Project", back_populates="tasks")
 
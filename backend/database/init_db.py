@@ -1,11 +1,37 @@
-"""建表脚本"""
+"""建表脚本 + 轻量迁移"""
 
+from sqlalchemy import inspect, text
 from .database import engine, Base
 
 
+def migrate_database():
+    """给旧库补上模型中新增的列和索引（create_all 不会修改已存在的表）"""
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {preparer.quote(table.name)} "
+                        f"ADD COLUMN {preparer.quote(column.name)} {col_type}"
+                    )
+                )
+                print(f"数据库迁移：{table.name} 新增列 {column.name}")
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
 def init_database():
     """创建所有表"""
     Base.metadata.create_all(bind=engine)
+    migrate_database()
     print("数据库表创建完成")
 
 
@@ -4,8 +4,11 @@ from database import SessionLocal
 from database.init_db import init_database
 from routers import projects, config, characters, tasks, assets, scripts, postfx
 from utils.init_config import init_settings 
-from workers.worker import start_worker
+from config import EMBEDDED_WORKER
+from workers.worker import start_worker, stop_worker
+from workers import tts_client
 from contextlib import asynccontextmanager
+import asyncio
 import os
 from fastapi.staticfiles import StaticFiles
 
@@ -22,10 +25,23 @@ try:
 finally:
     db.close()
 
+# 服务退出时等待内置 Worker 执行中任务收尾的时间
+SHUTDOWN_GRACE_SECONDS = 10
+# 关闭 TTS 通道后，再等被取消请求的任务写回重试状态的时间
+SHUTDOWN_SETTLE_SECONDS = 3
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    start_worker()
+    if EMBEDDED_WORKER:
+        start_worker()
     yield
+    left = 0
+    if EMBEDDED_WORKER:
+        # 先停止领取并等执行中的任务结束再关 TTS 通道；超时后仍在等 TTS 的任务会收到可重试错误，重新排队
+        left = await asyncio.to_thread(stop_worker, SHUTDOWN_GRACE_SECONDS)
+    tts_client.shutdown()
+    if left:
+        await asyncio.to_thread(stop_worker, SHUTDOWN_SETTLE_SECONDS)
 
 app = FastAPI(lifespan=lifespan)
 
@@ -2,8 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 from database import get_db
-from database import Character, Task
+from database import Character
 from schemas.character import CharacterResponse, CharacterUpdate, CharacterCreate
+from workers.task_queue import submit_task
 import uuid
 
 
@@ -79,14 +80,18 @@ def preview_voice(character_id: str, db: Session = Depends(get_db)):
     instruct = f"{gender}，{age}。{personality}。声音特征为：{voice_details}"
     text = char.ref_text
     
-    task = Task(
-        id=str(uuid.uuid4()),
-        project_id=char.project_id,
-        type="synthesis_voicedesign",
-        status="pending",
-        payload={"character_id": character_id, "text": text, "instruct": instruct}
+    # 连点合并：同样的 text + instruct 正在生成时复用同一任务；
+    # 刚生成完的结果仅在它仍是角色当前参考音时复用
+    def still_current(task):
+        audio_url = (task.result or {}).get("audio_url") or ""
+        return bool(char.ref_audio_path) and audio_url.rsplit("/", 1)[-1] == char.ref_audio_path
+
+    task = submit_task(
+        db,
+        char.project_id,
+        "synthesis_voicedesign",
+        {"character_id": character_id, "text": text, "instruct": instruct},
+        reuse_result=still_current,
     )
-    db.add(task)
-    db.commit()
     
     return {"task_id": task.id}
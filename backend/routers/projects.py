@@ -1,6 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from database import get_db
 from database import (
     Project,
@@ -13,9 +13,10 @@ from database import (
 )
 from schemas.project import ProjectCreate, ProjectUpdate, ProjectResponse
 from schemas.character import CharacterResponse
+from schemas.task import TaskResponse
+from workers.task_queue import submit_task
 import shutil
 import os
-import uuid
 from langdetect import detect, LangDetectException  
 
 
@@ -136,19 +137,29 @@ def analyze_characters(project_id: str, db: Session = Depends(get_db)):
     # 更新 Project.state 为 analyzing_characters
     project.state = "analyzing_characters"
     
-    # 创建 Task
-    task = Task(
-        id=str(uuid.uuid4()),
-        project_id=project_id,
-        type="analyze_char",
-        status="pending",
-        payload={}
-    )
-    db.add(task)
-    db.commit()
+    # 创建 Task（连同 state 一起提交，并唤醒 Worker）
+    task = submit_task(db, project_id, "analyze_char")
     
     return {"task_id": task.id}
 
+# 项目下的任务列表，可按状态/类型过滤（走 tasks(project_id, status, created_at) 索引）
+@router.get("/{project_id}/tasks", response_model=List[TaskResponse])
+def get_project_tasks(
+    project_id: str,
+    status: Optional[List[str]] = Query(default=None),
+    type: Optional[str] = Query(default=None),
+    limit: int = Query(default=100, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    if not db.query(Project.id).filter(Project.id == project_id).first():
+        raise HTTPException(status_code=404, detail="Project not found")
+    query = db.query(Task).filter(Task.project_id == project_id)
+    if status:
+        query = query.filter(Task.status.in_(status))
+    if type:
+        query = query.filter(Task.type == type)
+    return query.order_by(Task.created_at.desc()).limit(limit).all()
+
 @router.get("/{project_id}/characters", response_model=List[CharacterResponse])
 def get_characters(project_id: str, db: Session = Depends(get_db)):
     characters = db.query(Character).filter(Character.project_id == project_id).all()
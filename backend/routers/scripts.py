@@ -1,14 +1,21 @@
 import re
-import uuid
-import datetime
-from typing import List, Optional, Dict, Literal
+from typing import Any, List, Optional, Dict, Literal, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 
-from database import get_db, Project, Character, ScriptLine, Task
+from database import get_db, Project, Character, ScriptLine, Config
 from schemas.scriptline import ScriptLineResponse, ScriptLineUpdate
+from workers.synthesis_script import CLONE_BACKENDS
+from workers.task_queue import (
+    line_is_stale,
+    queued_synthesis_lines,
+    script_pipeline_state,
+    submit_task,
+    timeline_ready,
+)
 
 
 router = APIRouter(prefix="/api", tags=["Script"])
@@ -21,6 +28,8 @@ class AddLineRequest(BaseModel):
 class SynthesisRequest(BaseModel):
     project_id: str
     line_ids: List[int]
+    # 用户当前所在的台词，离它越近的台词越先合成
+    focus_line_id: Optional[int] = None
 
 
 class ReorderRequest(BaseModel):
@@ -30,6 +39,11 @@ class ReorderRequest(BaseModel):
 class ResolveStaleAudioRequest(BaseModel):
     action: Literal["keep", "clear", "resynthesize"]
     line_ids: Optional[List[int]] = None
+    character_ids: Optional[List[str]] = None
+
+
+# 重新合成时单个任务最多包含的行数，超出的拆成多个任务，便于进度展示与失败重试
+RESYNTH_TASK_MAX_LINES = 500
 
 
 def _assert_project(project_id: str, db: Session) -> Project:
@@ -39,6 +53,18 @@ def _assert_project(project_id: str, db: Session) -> Project:
     return project
 
 
+def _assert_clone_backend(db: Session):
+    """台词合成要用参考音克隆，当前 TTS 后端不支持时直接拒绝，不入队后再失败"""
+    item = db.query(Config).filter(Config.key == "tts.backend").first()
+    backend = item.value if item and item.value else "autodl"
+    if backend not in CLONE_BACKENDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"TTS backend {backend} does not support script line synthesis, "
+            f"switch to one of: {', '.join(sorted(CLONE_BACKENDS))}",
+        )
+
+
 def _sentences_from_text(content: str) -> List[str]:
     if not content:
         return []
@@ -107,13 +133,28 @@ def _line_to_response(
     )
 
 
-def _line_is_stale(line: ScriptLine, char_revision_map: Dict[str, int]) -> bool:
-    if line.status != "synthesized" or not line.character_id:
-        return False
-    current_rev = char_revision_map.get(line.character_id)
-    if current_rev is None:
-        return True
-    return int(line.last_synth_voice_revision or 0) != int(current_rev)
+def _stale_lines_query(db: Session, project_id: str, character_ids: Optional[List[str]] = None):
+    """
+    与 line_is_stale 同口径的 SQL 版本：已合成、且合成时的音色版本与角色当前版本不一致（或角色已不存在）。
+    在库里过滤，不用把整本台词读进内存逐行比对
+    """
+    query = (
+        db.query(ScriptLine)
+        .outerjoin(Character, Character.id == ScriptLine.character_id)
+        .filter(
+            ScriptLine.project_id == project_id,
+            ScriptLine.status == "synthesized",
+            ScriptLine.character_id.isnot(None),
+            or_(
+                Character.id.is_(None),
+                func.coalesce(ScriptLine.last_synth_voice_revision, 0)
+                != func.coalesce(Character.voice_revision, 1),
+            ),
+        )
+    )
+    if character_ids:
+        query = query.filter(ScriptLine.character_id.in_(character_ids))
+    return query.order_by(ScriptLine.order_index.asc(), ScriptLine.id.asc())
 
 
 def _build_timeline_segments(lines: List[ScriptLine], max_lines: int = 90, max_duration_sec: float = 180.0):
@@ -178,7 +219,7 @@ def _build_pipeline_status(project_id: str, db: Session, ensure_script: bool = F
 
     char_map = {c.id: c.name for c in chars}
     char_revision_map = {c.id: int(c.voice_revision or 1) for c in chars}
-    stale_rows = [line for line in rows if _line_is_stale(line, char_revision_map)]
+    stale_rows = [line for line in rows if line_is_stale(line, char_revision_map)]
     stale_ids = [line.id for line in stale_rows]
 
     stale_group = {}
@@ -210,11 +251,7 @@ def _build_pipeline_status(project_id: str, db: Session, ensure_script: bool = F
     synthesized_total = len([line for line in rows if line.status == "synthesized"])
     stale_total = len(stale_rows)
     fresh_synthesized_total = synthesized_total - stale_total
-    can_enter_timeline = (
-        can_enter_studio
-        and script_total > 0
-        and fresh_synthesized_total == script_total
-    )
+    can_enter_timeline = timeline_ready(chars, rows)
 
     return {
         "project_id": project_id,
@@ -392,13 +429,13 @@ def synthesize_script(req: SynthesisRequest, db: Session = Depends(get_db)):
     project = _assert_project(req.project_id, db)
     if not req.line_ids:
         raise HTTPException(status_code=400, detail="line_ids is required")
+    _assert_clone_backend(db)
 
     characters = db.query(Character).filter(Character.project_id == req.project_id).all()
     if not characters:
         raise HTTPException(status_code=400, detail="No characters found. Confirm characters first.")
     if any(not c.is_confirmed for c in characters):
         raise HTTPException(status_code=400, detail="Some characters are not confirmed")
-    char_revision_map = {c.id: int(c.voice_revision or 1) for c in characters}
 
     rows = (
         db.query(ScriptLine)
@@ -408,30 +445,18 @@ def synthesize_script(req: SynthesisRequest, db: Session = Depends(get_db)):
     if not rows:
         raise HTTPException(status_code=404, detail="No script lines found")
 
-    for line in rows:
-        line.status = "synthesized"
-        line.duration = _estimate_duration(line.text, line.speed or 1.0)
-        if line.character_id:
-            line.last_synth_voice_revision = char_revision_map.get(line.character_id)
-        else:
-            line.last_synth_voice_revision = None
+    # 已在排队/执行中的合成任务里的行不再重复入队，返回已有任务
+    rows, queued_tasks = _split_queued_lines(db, req.project_id, rows)
+    if not rows:
+        return {"task_id": None, "queued_tasks": queued_tasks}
 
-    task = Task(
-        id=str(uuid.uuid4()),
-        project_id=req.project_id,
-        type="synthesis_script",
-        status="success",
-        payload={"line_ids": req.line_ids},
-        result={"line_ids": [line.id for line in rows], "audio_url": None},
-        created_at=datetime.datetime.now(),
-    )
-    db.add(task)
+    # 实际合成由 Worker 的 synthesis_script 任务完成，这里只入队
     project.state = "synthesizing"
-    db.flush()
-    summary = _build_pipeline_status(req.project_id, db, ensure_script=False)
-    project.state = "completed" if summary["can_enter_timeline"] else "script_ready"
-    db.commit()
-    return {"task_id": task.id}
+    payload = {"line_ids": [line.id for line in sorted(rows, key=lambda x: (x.order_index or 0, x.id))]}
+    if req.focus_line_id is not None:
+        payload["focus_line_id"] = req.focus_line_id
+    task = submit_task(db, req.project_id, "synthesis_script", payload)
+    return {"task_id": task.id, "queued_tasks": queued_tasks}
 
 
 @router.get("/projects/{project_id}/pipeline-status")
@@ -441,42 +466,106 @@ def get_project_pipeline_status(project_id: str, db: Session = Depends(get_db)):
 
 @router.post("/projects/{project_id}/synthesis/stale-audio/resolve")
 def resolve_stale_audio(project_id: str, req: ResolveStaleAudioRequest, db: Session = Depends(get_db)):
-    _assert_project(project_id, db)
-    characters = db.query(Character).filter(Character.project_id == project_id).all()
-    char_revision_map = {c.id: int(c.voice_revision or 1) for c in characters}
-
-    rows = (
-        db.query(ScriptLine)
-        .filter(ScriptLine.project_id == project_id)
-        .order_by(ScriptLine.order_index.asc(), ScriptLine.id.asc())
-        .all()
-    )
-    stale_rows = [line for line in rows if _line_is_stale(line, char_revision_map)]
+    project = _assert_project(project_id, db)
+    query = _stale_lines_query(db, project_id, req.character_ids)
     if req.line_ids:
-        target_ids = set(req.line_ids)
-        stale_rows = [line for line in stale_rows if line.id in target_ids]
+        query = query.filter(ScriptLine.id.in_(req.line_ids))
+    stale_rows = query.all()
     if not stale_rows:
         return {"message": "No stale lines to resolve", "affected": 0}
 
+    characters = (
+        db.query(Character)
+        .filter(Character.id.in_({line.character_id for line in stale_rows}))
+        .all()
+    )
+    char_map = {c.id: c for c in characters}
+
+    if req.action == "resynthesize":
+        return _enqueue_stale_resynthesis(project, stale_rows, char_map, db)
+
     affected = 0
     for line in stale_rows:
         if req.action == "keep":
-            line.last_synth_voice_revision = char_revision_map.get(line.character_id) if line.character_id else None
+            char = char_map.get(line.character_id)
+            line.last_synth_voice_revision = int(char.voice_revision or 1) if char else None
         elif req.action == "clear":
             line.status = "pending"
             line.audio_path = None
             line.duration = None
             line.last_synth_voice_revision = None
-        elif req.action == "resynthesize":
-            line.status = "synthesized"
-            line.duration = _estimate_duration(line.text, line.speed or 1.0)
-            line.last_synth_voice_revision = char_revision_map.get(line.character_id) if line.character_id else None
         affected += 1
 
-    project = db.query(Project).filter(Project.id == project_id).first()
     db.flush()
-    summary_preview = _build_pipeline_status(project_id, db, ensure_script=False)
-    if project:
-        project.state = "completed" if summary_preview["can_enter_timeline"] else "script_ready"
+    project.state = script_pipeline_state(db, project_id)
     db.commit()
     return {"message": "Stale audio resolved", "affected": affected, "action": req.action}
+
+
+def _split_queued_lines(db: Session, project_id: str, rows: List[ScriptLine]) -> Tuple[List[ScriptLine], List[Dict[str, Any]]]:
+    """挑出已在排队/执行中的合成任务里的行，返回 (还需入队的行, 已有任务列表)"""
+    queued = queued_synthesis_lines(db, project_id)
+    already_queued: Dict[str, List[int]] = {}
+    pending_rows = []
+    for line in rows:
+        if line.id in queued:
+            already_queued.setdefault(queued[line.id], []).append(line.id)
+        else:
+            pending_rows.append(line)
+    queued_tasks = [
+        {"task_id": task_id, "line_count": len(line_ids)} for task_id, line_ids in already_queued.items()
+    ]
+    return pending_rows, queued_tasks
+
+
+def _enqueue_stale_resynthesis(project: Project, stale_rows: List[ScriptLine], char_map: Dict[str, Character], db: Session):
+    """
+    只重新合成过期的行：按角色分组，每个角色的行拆成若干个 synthesis_script 任务。
+    行在新音频写好前一直是过期状态，已在排队/执行中的合成任务里的行不再重复入队，返回已有任务。
+    """
+    stale_rows, queued_tasks = _split_queued_lines(db, project.id, stale_rows)
+    by_character: Dict[str, List[int]] = {}
+    skipped = []
+    for line in stale_rows:
+        if line.character_id not in char_map:
+            # 角色已删除，需要先重新指定角色
+            skipped.append(line.id)
+            continue
+        by_character.setdefault(line.character_id, []).append(line.id)
+
+    if by_character:
+        _assert_clone_backend(db)
+    unconfirmed = [char_map[cid].name for cid in by_character if not char_map[cid].is_confirmed]
+    if unconfirmed:
+        raise HTTPException(status_code=400, detail=f"Characters not confirmed: {', '.join(unconfirmed)}")
+    if not by_character:
+        message = "Stale lines are already queued" if queued_tasks else "No stale lines can be resynthesized"
+        return {
+            "message": message,
+            "affected": 0,
+            "action": "resynthesize",
+            "queued_tasks": queued_tasks,
+            "skipped_line_ids": skipped,
+        }
+
+    project.state = "synthesizing"
+    tasks = []
+    for character_id, line_ids in by_character.items():
+        for start in range(0, len(line_ids), RESYNTH_TASK_MAX_LINES):
+            chunk = line_ids[start:start + RESYNTH_TASK_MAX_LINES]
+            task = submit_task(
+                db,
+                project.id,
+                "synthesis_script",
+                {"line_ids": chunk, "character_id": character_id, "reason": "stale"},
+            )
+            tasks.append({"task_id": task.id, "character_id": character_id, "line_count": len(chunk)})
+
+    return {
+        "message": "Stale lines queued for resynthesis",
+        "affected": sum(item["line_count"] for item in tasks),
+        "action": "resynthesize",
+        "tasks": tasks,
+        "queued_tasks": queued_tasks,
+        "skipped_line_ids": skipped,
+    }
@@ -1,14 +1,135 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, SessionLocal
 from database import Task
-from schemas.task import TaskResponse
+from config import EMBEDDED_WORKER
+from schemas.task import TaskResponse, TaskStatusBatchRequest
+from workers import events
+from workers.task_queue import cancel_task
 
 router = APIRouter(prefix="/api/tasks", tags=["Tasks"])
 
+# 无事件时的心跳间隔；同时回查一次数据库，兜底其他进程里 Worker 产生的状态变化
+SSE_KEEPALIVE_SECONDS = 15
+# Worker 跑在独立进程时事件总线收不到状态变化，只能靠回查数据库，缩短间隔
+SSE_EXTERNAL_POLL_SECONDS = 2
+SSE_POLL_SECONDS = SSE_KEEPALIVE_SECONDS if EMBEDDED_WORKER else SSE_EXTERNAL_POLL_SECONDS
+
+
+def _load_task_events(task_id: Optional[str], project_id: Optional[str], known_ids=()):
+    """known_ids：已推送过的任务，即使已经结束也要读出来，把终态推送一次"""
+    db = SessionLocal()
+    try:
+        query = db.query(Task)
+        if task_id:
+            query = query.filter(Task.id == task_id)
+        else:
+            active = Task.status.notin_(events.TERMINAL_STATUSES)
+            query = query.filter(
+                Task.project_id == project_id,
+                or_(active, Task.id.in_(list(known_ids))) if known_ids else active,
+            )
+        return [events.task_event(task) for task in query.order_by(Task.created_at).all()]
+    finally:
+        db.close()
+
+
+def _format_sse(event: dict) -> str:
+    return f"event: task\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+
+def _event_signature(event: dict):
+    return (
+        event.get("status"),
+        json.dumps(event.get("result"), sort_keys=True, default=str),
+        json.dumps(event.get("progress"), sort_keys=True, default=str),
+    )
+
+
+async def _task_event_stream(request: Request, task_id: Optional[str], project_id: Optional[str]):
+    sub = events.subscribe(task_id=task_id, project_id=project_id)
+    last_seen = {}
+    try:
+        # 先订阅再发快照，快照之后发生的变化一定能从事件队列拿到
+        snapshots = await run_in_threadpool(_load_task_events, task_id, project_id)
+        for event in snapshots:
+            last_seen[event["id"]] = _event_signature(event)
+            yield _format_sse(event)
+            if task_id and event["status"] in events.TERMINAL_STATUSES:
+                return
+
+        while not await request.is_disconnected():
+            try:
+                pending = [await asyncio.wait_for(sub.queue.get(), timeout=SSE_POLL_SECONDS)]
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                refreshed = await run_in_threadpool(_load_task_events, task_id, project_id, list(last_seen))
+                pending = [e for e in refreshed if last_seen.get(e["id"]) != _event_signature(e)]
+
+            for event in pending:
+                last_seen[event["id"]] = _event_signature(event)
+                yield _format_sse(event)
+                if event["status"] in events.TERMINAL_STATUSES:
+                    if task_id:
+                        return
+                    # 终态已推送，之后回查不再带上这个任务
+                    last_seen.pop(event["id"], None)
+    finally:
+        events.unsubscribe(sub)
+
+
+def _sse_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# 项目内所有任务的状态推送（SSE），需定义在 /{task_id} 之前
+@router.get("/events")
+def stream_project_task_events(project_id: str, request: Request):
+    return _sse_response(_task_event_stream(request, None, project_id))
+
+
+# 批量查询任务状态：一次主键 IN 查询，只返回存在的任务
+@router.post("/status", response_model=List[TaskResponse])
+def get_tasks_status(req: TaskStatusBatchRequest, db: Session = Depends(get_db)):
+    task_ids = list(dict.fromkeys(req.task_ids))
+    if not task_ids:
+        return []
+    return db.query(Task).filter(Task.id.in_(task_ids)).all()
+
+
 @router.get("/{task_id}", response_model=TaskResponse)
 def get_task_status(task_id: str, db: Session = Depends(get_db)):
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
+
+
+# 取消任务：排队中的立即取消，执行中的在下一个检查点（逐行/逐次 TTS 请求之间）退出
+@router.post("/{task_id}/cancel", response_model=TaskResponse)
+def cancel_task_endpoint(task_id: str, db: Session = Depends(get_db)):
+    task = cancel_task(db, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.status in events.TERMINAL_STATUSES and task.status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Task already {task.status}")
+    return task
+
+
+# 单个任务的状态推送（SSE），任务结束后自动关闭连接
+@router.get("/{task_id}/events")
+def stream_task_events(task_id: str, request: Request, db: Session = Depends(get_db)):
+    exists = db.query(Task.id).filter(Task.id == task_id).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return _sse_response(_task_event_stream(request, task_id, None))
@@ -1,23 +1,32 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List
 
 # front->back: 创建任务
 class TaskCreate(BaseModel):
     type: str  # analyze_char, parse_script, synthesis
     payload: Optional[Dict[str, Any]] = None
 
+# front->back: 批量查询任务状态
+class TaskStatusBatchRequest(BaseModel):
+    task_ids: List[str] = Field(..., max_length=500)
+
 # back->front: 任务响应
 class TaskResponse(BaseModel):
     id: str
+    project_id: Optional[str] = None
     type: str
-    status: str  # pending/processing/success/failed
+    status: str  # pending/processing/success/failed/cancelled/dead_letter
+    cancel_requested: Optional[bool] = None
+    attempts: Optional[int] = None
+    next_attempt_at: Optional[datetime] = None
     result: Optional[Dict[str, Any]] = None
     error_msg: Optional[str] = None
     created_at: datetime
     # 可选的进度信息
     position: Optional[int] = None  # 排队位置
-    progress: Optional[Dict[str, Any]] = None  # {"current": 15, "total": 50, "percent": 30}
+    # {"done": 15, "total": 50, "percent": 30.0, "current_line_id": 1015, "items_per_sec": 0.8, "eta_seconds": 43.8}
+    progress: Optional[Dict[str, Any]] = None
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -115,7 +115,7 @@ DEFAULT_CONFIGS = [
     # C. TTS Settings (语音合成设置)
     {
         "key": "tts.backend", "group": "tts_settings", "label": "TTS 后端类型",
-        "type": "select", "options": ["local_pytorch", "local_vllm", "autodl", "aliyun"], "default": "aliyun", "value": "aliyun"
+        "type": "select", "options": ["local_pytorch", "local_vllm", "autodl", "qwen_api", "aliyun"], "default": "aliyun", "value": "aliyun"
     },
     # C1. 本地pytorch部署
     {
@@ -132,23 +132,36 @@ DEFAULT_CONFIGS = [
     },
     # C2. 本地vllm部署
     {
-        "key": "tts.vllm.base_url", "group": "tts_settings", "label": "vLLM Base模型服务地址",
+        "key": "tts.vllm.base_url", "group": "tts_settings", "label": "vLLM Base模型服务地址 (多个副本用逗号分隔)",
         "type": "text", "options": None, "default": "http://localhost:6008", "value": "http://localhost:6008"
     },
     {
-        "key": "tts.vllm.vd_url", "group": "tts_settings", "label": "vLLM VoiceDesign模型服务地址",
+        "key": "tts.vllm.vd_url", "group": "tts_settings", "label": "vLLM VoiceDesign模型服务地址 (多个副本用逗号分隔)",
         "type": "text", "options": None, "default": "http://localhost:6006", "value": "http://localhost:6006"
     },
     # C3. Autodl穿透
     {
-        "key": "tts.autodl.base_port", "group": "tts_settings", "label": "Base模型本地端口",
+        "key": "tts.autodl.base_port", "group": "tts_settings", "label": "Base模型本地端口 (多个用逗号分隔)",
         "type": "text", "options": None, "default": "6008", "value": "6008"
     },
     {
-        "key": "tts.autodl.vd_port", "group": "tts_settings", "label": "VoiceDesign模型本地端口",
+        "key": "tts.autodl.vd_port", "group": "tts_settings", "label": "VoiceDesign模型本地端口 (多个用逗号分隔)",
         "type": "text", "options": None, "default": "6006", "value": "6006"
     },
-    # C4. 阿里云API
+    # C4. models_deploy 中的 Qwen REST 服务
+    {
+        "key": "tts.qwen_api.vd_url", "group": "tts_settings", "label": "VoiceDesign服务地址 (多个副本用逗号分隔)",
+        "type": "text", "options": None, "default": "http://localhost:8001", "value": "http://localhost:8001"
+    },
+    {
+        "key": "tts.qwen_api.clone_url", "group": "tts_settings", "label": "VoiceClone服务地址 (多个副本用逗号分隔)",
+        "type": "text", "options": None, "default": "http://localhost:8002", "value": "http://localhost:8002"
+    },
+    {
+        "key": "tts.qwen_api.batch_lines", "group": "tts_settings", "label": "每个批量请求的台词数 (1 为逐句请求)",
+        "type": "number", "options": None, "default": "8", "value": "8"
+    },
+    # C5. 阿里云API
     {
         "key": "tts.aliyun.api_key", "group": "tts_settings", "label": "DashScope API Key",
         "type": "password", "options": None, "default": "", "value": ""
@@ -157,6 +170,10 @@ DEFAULT_CONFIGS = [
         "key": "tts.aliyun.region", "group": "tts_settings", "label": "服务区域",
         "type": "select", "options": ["beijing", "singapore"], "default": "beijing", "value": "beijing"
     },
+    {
+        "key": "tts.max_inflight", "group": "tts_settings", "label": "单个后端最大在途请求数",
+        "type": "number", "options": None, "default": "64", "value": "64"
+    },
 
     # D. Synthesis Config (合成策略)
     {
@@ -174,6 +191,14 @@ DEFAULT_CONFIGS = [
     {
         "key": "syn.max_workers", "group": "synthesis_config", "label": "最大并发数",
         "type": "number", "options": None, "default": "2", "value": "2"
+    },
+    {
+        "key": "syn.batch_size", "group": "synthesis_config", "label": "台词合成并发请求数 (每个副本)",
+        "type": "number", "options": None, "default": "4", "value": "4"
+    },
+    {
+        "key": "syn.cache_max_mb", "group": "synthesis_config", "label": "合成缓存上限 (MB，0 为关闭)",
+        "type": "number", "options": None, "default": "2048", "value": "2048"
     }
 ]
 
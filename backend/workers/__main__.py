@@ -0,0 +1,5 @@
+from workers.runner import main
+
+
+if __name__ == "__main__":
+    main()
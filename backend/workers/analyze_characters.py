@@ -2,6 +2,7 @@ import json
 import os
 from sqlalchemy.orm import Session
 from database import Task, Project, Character, Config
+from .cancellation import raise_if_cancelled
 from openai import OpenAI
 import openai
 import logging
@@ -149,6 +150,9 @@ def analyze_characters_handler(task: Task, db: Session):
     )
 
 
+    # LLM 调用期间用户可能已取消，写角色表之前检查，避免取消后仍覆盖角色
+    raise_if_cancelled(task.id)
+
     generated_text = response.choices[0].message.content
     
     try:
@@ -0,0 +1,123 @@
+"""
+台词音频的内容寻址缓存：合成输入（文本、音色版本、参考音哈希、语速、模型、采样参数）相同时
+直接复用之前合成过的文件，不再请求 TTS。磁盘占用超过上限时按最近使用时间（mtime）淘汰。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Any, Dict, Optional
+from sqlalchemy.orm import Session
+from database import Config
+
+
+CACHE_DIR = os.path.join("storage", "cache", "tts")
+DEFAULT_MAX_MB = 2048
+# 超限后一次淘汰到上限的 90%，避免每写一个文件都触发一次全目录扫描
+EVICT_TARGET_RATIO = 0.9
+
+_lock = threading.Lock()
+_total_bytes: Optional[int] = None
+
+
+def get_max_bytes(db: Session) -> int:
+    """syn.cache_max_mb：缓存目录大小上限，0 表示关闭缓存"""
+    item = db.query(Config).filter(Config.key == "syn.cache_max_mb").first()
+    try:
+        value = float(item.value) if item and item.value not in (None, "") else DEFAULT_MAX_MB
+    except (TypeError, ValueError):
+        value = DEFAULT_MAX_MB
+    return max(int(value * 1024 * 1024), 0)
+
+
+def cache_key(parts: Dict[str, Any]) -> str:
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _path_for(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.wav")
+
+
+def _scan():
+    entries = []
+    for root, _dirs, files in os.walk(CACHE_DIR):
+        for name in files:
+            if not name.endswith(".wav"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def _ensure_total() -> int:
+    global _total_bytes
+    if _total_bytes is None:
+        _total_bytes = sum(size for _mtime, size, _path in _scan())
+    return _total_bytes
+
+
+def _link_or_copy(src: str, dest: str):
+    # 同一文件系统优先硬链接，不占额外空间；淘汰缓存时只删链接，不影响已输出的文件
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def fetch(key: str, dest: str) -> bool:
+    """命中时把缓存文件放到 dest 并刷新其最近使用时间"""
+    path = _path_for(key)
+    if not os.path.isfile(path):
+        return False
+    try:
+        os.utime(path)
+        tmp = f"{dest}.{uuid.uuid4().hex[:8]}.tmp"
+        _link_or_copy(path, tmp)
+        os.replace(tmp, dest)
+    except FileNotFoundError:
+        # 刚好被其他进程淘汰
+        return False
+    return True
+
+
+def store(key: str, src: str, max_bytes: int):
+    """合成成功后写入缓存，超过 max_bytes 时按 LRU 淘汰"""
+    global _total_bytes
+    if max_bytes <= 0 or not os.path.isfile(src):
+        return
+    path = _path_for(key)
+    if os.path.exists(path):
+        os.utime(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    _link_or_copy(src, tmp)
+    os.replace(tmp, path)
+
+    with _lock:
+        total = _ensure_total() + os.path.getsize(path)
+        _total_bytes = total
+        if total > max_bytes:
+            _total_bytes = _evict(int(max_bytes * EVICT_TARGET_RATIO))
+
+
+def _evict(target_bytes: int) -> int:
+    entries = sorted(_scan())
+    total = sum(size for _mtime, size, _path in entries)
+    for _mtime, size, path in entries:
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
@@ -0,0 +1,55 @@
+"""任务协作式取消：handler 在逐行/逐次请求之间调用 raise_if_cancelled 检查"""
+
+import threading
+import time
+from database import SessionLocal, Task
+
+
+# 同一任务两次查库的最小间隔，避免逐行检查时把压力转移到数据库上
+DB_CHECK_INTERVAL = 1.0
+
+
+class TaskCancelled(Exception):
+    """任务已被用户取消，由 Worker 捕获后把任务标记为 cancelled"""
+
+
+_requested: set[str] = set()
+_last_checked: dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def mark_cancel_requested(task_id: str):
+    """本进程内的快速通道，取消接口与 Worker 在同一进程时无需等待查库"""
+    with _lock:
+        _requested.add(task_id)
+
+
+def clear_cancel_state(task_id: str):
+    with _lock:
+        _requested.discard(task_id)
+        _last_checked.pop(task_id, None)
+
+
+def is_cancel_requested(task_id: str) -> bool:
+    with _lock:
+        if task_id in _requested:
+            return True
+        now = time.monotonic()
+        if now - _last_checked.get(task_id, 0.0) < DB_CHECK_INTERVAL:
+            return False
+        _last_checked[task_id] = now
+
+    # 取消请求可能来自其他进程（API 与 Worker 分开部署），以库里的标记为准
+    db = SessionLocal()
+    try:
+        flag = db.query(Task.cancel_requested).filter(Task.id == task_id).scalar()
+    finally:
+        db.close()
+    if flag:
+        mark_cancel_requested(task_id)
+    return bool(flag)
+
+
+def raise_if_cancelled(task_id: str):
+    if is_cancel_requested(task_id):
+        raise TaskCancelled(f"Task {task_id} cancelled")
@@ -0,0 +1,50 @@
+"""任务错误分类：可重试（网络抖动、限流、服务端 5xx）与不可重试（参数/配置错误）"""
+
+import httpx
+import requests
+import openai
+
+
+# 这些 HTTP 状态码视为服务端暂时不可用
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """暂时性失败，Worker 会按退避策略重新排队"""
+
+
+class FatalError(Exception):
+    """重试也不会成功的失败，直接把任务标记为 failed"""
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, RetryableError):
+        return True
+    if isinstance(exc, FatalError):
+        return False
+    # requests：连接被拒/重置、读写超时
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return is_retryable_status(exc.response.status_code)
+    # httpx（TTS 异步连接池）：连接失败、超时
+    if isinstance(exc, (httpx.TransportError, httpx.TimeoutException)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return is_retryable_status(exc.response.status_code)
+    # openai SDK：LLM 接口超时、连接失败、限流、5xx
+    if isinstance(
+        exc,
+        (
+            openai.APIConnectionError,
+            openai.APITimeoutError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        ),
+    ):
+        return True
+    return isinstance(exc, (ConnectionError, TimeoutError))
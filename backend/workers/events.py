@@ -0,0 +1,79 @@
+"""进程内任务事件总线：Worker 线程发布任务状态变化，SSE 接口（asyncio）订阅"""
+
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+from database import Task
+
+
+TERMINAL_STATUSES = {"success", "failed", "cancelled", "dead_letter"}
+# 单个订阅者积压上限，消费太慢时丢弃最旧事件（客户端总能拿到最新状态）
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, task_id: Optional[str], project_id: Optional[str]):
+        self.loop = loop
+        self.task_id = task_id
+        self.project_id = project_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.task_id and event.get("id") != self.task_id:
+            return False
+        if self.project_id and event.get("project_id") != self.project_id:
+            return False
+        return True
+
+
+_subscribers: set[Subscription] = set()
+_subscribers_lock = threading.Lock()
+
+
+def task_event(task: Task) -> Dict[str, Any]:
+    """把 Task 行转换成推送给前端的事件体，字段与 TaskResponse 对齐"""
+    return {
+        "id": task.id,
+        "project_id": task.project_id,
+        "type": task.type,
+        "status": task.status,
+        "result": task.result,
+        "error_msg": task.error_msg,
+        "progress": task.progress,
+        "created_at": task.created_at.isoformat() if task.created_at else None,
+    }
+
+
+def subscribe(task_id: Optional[str] = None, project_id: Optional[str] = None) -> Subscription:
+    """必须在事件循环内调用；task_id / project_id 为空表示不按该维度过滤"""
+    sub = Subscription(asyncio.get_running_loop(), task_id, project_id)
+    with _subscribers_lock:
+        _subscribers.add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscription):
+    with _subscribers_lock:
+        _subscribers.discard(sub)
+
+
+def _offer(queue: asyncio.Queue, event: Dict[str, Any]):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+def publish(event: Dict[str, Any]):
+    """线程安全，可在 Worker 线程中直接调用"""
+    with _subscribers_lock:
+        targets = [sub for sub in _subscribers if sub.matches(event)]
+    for sub in targets:
+        try:
+            sub.loop.call_soon_threadsafe(_offer, sub.queue, event)
+        except RuntimeError:
+            # 事件循环已关闭（服务退出中），直接丢弃
+            unsubscribe(sub)
+
+
+def publish_task(task: Task):
+    publish(task_event(task))
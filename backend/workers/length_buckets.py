@@ -0,0 +1,56 @@
+"""
+按估算长度给台词分桶，批量合成时同一批只放长度相近的句子。
+自回归生成要跑到批内最长的一句结束，长短句混在一批时，短句占的位置几乎全是填充。
+"""
+
+import bisect
+from typing import Callable, List, Sequence, TypeVar
+
+# 与时间轴估算时长相同的语速假设（每秒约 6.5 字符），Qwen3-TTS 12Hz 编码器每秒 12 帧
+CHARS_PER_SECOND = 6.5
+CODEC_FRAME_RATE = 12.0
+# 分桶边界（估算 token 数），相邻边界翻倍，同一桶内的句子长度相差不超过一倍
+LENGTH_BUCKETS = (24, 48, 96, 192, 384)
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str, speed: float = 1.0) -> int:
+    content = (text or "").strip()
+    safe_speed = speed if speed and speed > 0 else 1.0
+    seconds = max(0.8, len(content) / (CHARS_PER_SECOND * safe_speed))
+    return int(seconds * CODEC_FRAME_RATE) + 1
+
+
+def length_bucket(tokens: int) -> int:
+    return bisect.bisect_left(LENGTH_BUCKETS, tokens)
+
+
+def plan_batches(items: Sequence[T], size: int, tokens_of: Callable[[T], int]) -> List[List[T]]:
+    """
+    同一桶内按原顺序每 size 条切一批；批次按首句在原序列中的位置排序，
+    靠前的台词仍然先合成。
+    """
+    size = max(int(size), 1)
+    buckets = {}
+    for position, item in enumerate(items):
+        buckets.setdefault(length_bucket(tokens_of(item)), []).append((position, item))
+
+    batches = []
+    for entries in buckets.values():
+        for start in range(0, len(entries), size):
+            batches.append(entries[start:start + size])
+    batches.sort(key=lambda batch: batch[0][0])
+    return [[item for _position, item in batch] for batch in batches]
+
+
+def padding_ratio(batches: Sequence[Sequence[T]], tokens_of: Callable[[T], int]) -> float:
+    """按「批内最长一句 × 条数」计算的生成步数里，填充所占的比例"""
+    padded = 0
+    useful = 0
+    for batch in batches:
+        tokens = [tokens_of(item) for item in batch]
+        if tokens:
+            padded += max(tokens) * len(tokens)
+            useful += sum(tokens)
+    return (padded - useful) / padded if padded else 0.0
@@ -0,0 +1,112 @@
+"""
+独立 Worker 进程，入口为 workers/__main__.py，在 backend/ 目录下运行：
+
+    uv run python -m workers --processes 2
+
+每个进程各自按 syn.max_workers 开线程池，通过数据库原子领取任务，可以与 API 进程内的
+Worker 同时运行；API 进程设置 EMBEDDED_WORKER=0 后任务全部交给这里执行。
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+
+# 独立进程收不到 API 进程的唤醒信号，靠更短的轮询保证试听等交互任务的响应
+DEFAULT_POLL_INTERVAL = 1.0
+# 收到退出信号后等待执行中任务收尾的时间，超时未完成的由租约回收重新排队
+DEFAULT_GRACE_SECONDS = 30.0
+
+
+def _prepare():
+    os.makedirs("storage", exist_ok=True)
+    from database import SessionLocal
+    from database.init_db import init_database
+    from utils.init_config import init_settings
+
+    init_database()
+    db = SessionLocal()
+    try:
+        init_settings(db)
+    finally:
+        db.close()
+
+
+def run_worker(poll_interval: float, grace_seconds: float):
+    """单个 Worker 进程：启动调度线程，阻塞到收到 SIGINT/SIGTERM"""
+    from workers import tts_client
+    from workers.task_queue import WORKER_ID
+    from workers.worker import start_worker, stop_worker
+
+    stop = threading.Event()
+
+    def _on_signal(*_):
+        # 等待收尾期间再收到一次信号则立即退出
+        if stop.is_set():
+            os._exit(1)
+        stop.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, _on_signal)
+
+    start_worker(poll_interval=poll_interval)
+    print(f"Worker {WORKER_ID} started")
+    while not stop.wait(1.0):
+        pass
+
+    print(f"Worker {WORKER_ID} stopping, waiting up to {grace_seconds:.0f}s for running tasks")
+    left = stop_worker(grace_seconds)
+    if left:
+        # 任务线程还在跑，正常退出会一直等它们结束；直接结束进程，让租约过期后由其他 Worker 重新排队
+        print(f"Worker {WORKER_ID} exiting with {left} unfinished task(s), leases will expire and requeue them")
+        sys.stdout.flush()
+        os._exit(1)
+    tts_client.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m workers", description="Run task workers outside the API server")
+    parser.add_argument("-n", "--processes", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help=f"seconds between queue polls when idle (default: {DEFAULT_POLL_INTERVAL})",
+    )
+    parser.add_argument(
+        "--grace",
+        type=float,
+        default=DEFAULT_GRACE_SECONDS,
+        help=f"seconds to let running tasks finish on shutdown (default: {DEFAULT_GRACE_SECONDS:.0f})",
+    )
+    args = parser.parse_args()
+
+    # 建表/迁移/默认配置只在父进程做一次，避免多个子进程同时迁移
+    _prepare()
+
+    if args.processes <= 1:
+        run_worker(args.poll_interval, args.grace)
+        return
+
+    # spawn：子进程重新导入模块，各自生成独立的 WORKER_ID 和数据库连接池
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=run_worker, args=(args.poll_interval, args.grace), name=f"worker-{i}")
+        for i in range(args.processes)
+    ]
+    for proc in procs:
+        proc.start()
+
+    def _forward(signum, _frame):
+        for proc in procs:
+            if proc.is_alive() and proc.pid:
+                os.kill(proc.pid, signum)
+
+    signal.signal(signal.SIGTERM, _forward)
+    # Ctrl+C 会同时发给整个进程组，父进程只需等待子进程退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for proc in procs:
+        proc.join()
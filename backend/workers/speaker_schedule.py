@@ -0,0 +1,52 @@
+"""
+按角色分组调度待合成的台词。剧本按阅读顺序是多个角色交替说话，逐句请求会让模型服务里的
+speaker prompt 缓存不停换入换出；这里把离光标最近的一段台词取出来，段内按角色排成连续的一串，
+同一角色的台词挨着发出去。
+"""
+
+from typing import Callable, Hashable, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def focus_distance(position: int, focus: Optional[int]) -> tuple:
+    """到光标的距离；等距时光标之后的台词优先（用户一般往下听）。没有光标时即阅读顺序"""
+    if focus is None:
+        return (position, 0)
+    offset = position - focus
+    return (abs(offset), 1 if offset < 0 else 0)
+
+
+def plan_speaker_runs(
+    items: Sequence[T],
+    speaker_of: Callable[[T], Hashable],
+    position_of: Callable[[T], int],
+    window: int,
+    focus: Optional[int] = None,
+) -> List[List[T]]:
+    """
+    按到光标的距离由近到远，每 window 条切成一段；段内按角色聚成连续的一串，
+    角色的先后按其离光标最近的一句排序，上一段最后一个角色在下一段里排在最前，
+    跨段也尽量不换角色。返回各段（段内已按角色排好序），先合成的段在前。
+    """
+    window = max(int(window), 1)
+    ordered = sorted(items, key=lambda item: focus_distance(position_of(item), focus))
+
+    windows = []
+    last_speaker = None
+    for start in range(0, len(ordered), window):
+        runs = {}
+        for item in ordered[start:start + window]:
+            runs.setdefault(speaker_of(item), []).append(item)
+        speakers = list(runs)
+        if last_speaker in runs:
+            speakers.remove(last_speaker)
+            speakers.insert(0, last_speaker)
+        windows.append([item for speaker in speakers for item in runs[speaker]])
+        last_speaker = speakers[-1]
+    return windows
+
+
+def speaker_switches(items: Sequence[T], speaker_of: Callable[[T], Hashable]) -> int:
+    """相邻两句换角色的次数，用于日志里对比调度前后的局部性"""
+    return sum(1 for prev, cur in zip(items, items[1:]) if speaker_of(prev) != speaker_of(cur))
@@ -0,0 +1,394 @@
+import os
+import wave
+import base64
+import hashlib
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+from sqlalchemy.orm import Session
+from database import Task, Config, Character, ScriptLine
+from . import audio_cache, tts_client
+from .cancellation import raise_if_cancelled
+from .errors import FatalError
+from .length_buckets import estimate_tokens, padding_ratio, plan_batches
+from .progress import ProgressReporter
+from .speaker_schedule import plan_speaker_runs, speaker_switches
+from .synthesis_voicedesign import get_tts_config
+from .tts_pool import endpoint_url, parse_endpoints
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 4
+MAX_BATCH_SIZE = 64
+STORAGE_ROOT = "storage"
+# 支持参考音克隆的后端；阿里云接口只能用预先注册的音色，不能按参考音逐句克隆
+CLONE_BACKENDS = {"autodl", "local_vllm", "qwen_api"}
+# 模型服务不接受语速参数的后端，合成后在本地做保持音高的变速
+POST_SPEED_BACKENDS = {"qwen_api"}
+# 各克隆后端的地址配置项，可以是多个副本
+CLONE_ENDPOINT_KEYS = {"autodl": "base_port", "local_vllm": "base_url", "qwen_api": "clone_url"}
+# 按角色分组调度的窗口：每次取离光标最近的「在途容量 × 该倍数」句台词，在其中按角色聚集
+SCHEDULE_WINDOW_ROUNDS = 4
+# 等待在途请求的最长间隔；没有请求完成时也按这个间隔检查取消，不必等慢请求返回
+CANCEL_POLL_SECONDS = 1.0
+
+
+def get_batch_size(db: Session) -> int:
+    """syn.batch_size：同时在途的台词请求数，按模型服务能同时处理的请求数设置"""
+    item = db.query(Config).filter(Config.key == "syn.batch_size").first()
+    try:
+        value = int(float(item.value)) if item and item.value else DEFAULT_BATCH_SIZE
+    except (TypeError, ValueError):
+        value = DEFAULT_BATCH_SIZE
+    return min(max(value, 1), MAX_BATCH_SIZE)
+
+
+def clone_replicas(config) -> int:
+    """克隆服务配置了几个副本；syn.batch_size 按单个副本计，总在途数随副本数增加"""
+    return len(parse_endpoints(config[CLONE_ENDPOINT_KEYS[config["backend"]]]))
+
+
+def resolve_ref_audio_path(char: Character) -> str:
+    """角色参考音可能在项目 voices 目录（确认/上传）或 temp 目录（试听生成）"""
+    ref = char.ref_audio_path or ""
+    if ref.startswith("/static/"):
+        candidates = [os.path.join(STORAGE_ROOT, ref[len("/static/"):])]
+    else:
+        candidates = [
+            os.path.join(STORAGE_ROOT, "projects", char.project_id, "voices", ref),
+            os.path.join(STORAGE_ROOT, "temp", ref),
+        ]
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    raise FatalError(f"Reference audio not found for character {char.name}: {ref}")
+
+
+def audio_duration(path: str) -> float:
+    try:
+        with wave.open(path, "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError):
+        # 非 PCM WAV（如 float 格式）交给 pedalboard 解析
+        from pedalboard.io import AudioFile
+        with AudioFile(path) as f:
+            return f.frames / float(f.samplerate)
+
+
+def apply_speed(path: str, speed: float):
+    """按 speed 做保持音高的变速（>1 变快），原地覆盖为 16-bit WAV"""
+    from pedalboard import time_stretch
+    from pedalboard.io import AudioFile
+
+    with AudioFile(path) as f:
+        samplerate = f.samplerate
+        audio = f.read(f.frames)
+    stretched = time_stretch(audio, samplerate, stretch_factor=speed)
+    tmp = f"{path}.speed.wav"
+    try:
+        with AudioFile(tmp, "w", samplerate, stretched.shape[0], bit_depth=16) as f:
+            f.write(stretched)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def build_clone_request(config, text, ref_audio_b64, ref_text, speed=1.0):
+    """按后端拼出克隆请求的 (url, payload)"""
+    backend = config["backend"]
+    if backend in ("autodl", "local_vllm"):
+        url = endpoint_url(config["base_port"] if backend == "autodl" else config["base_url"], "/v1/audio/speech")
+        payload = {
+            "task_type": "Base",
+            "input": text,
+            "ref_audio": f"data:audio/wav;base64,{ref_audio_b64}",
+            "ref_text": ref_text,
+            "language": "Auto",
+            "max_new_tokens": 2048,
+        }
+        if speed and speed != 1.0:
+            payload["speed"] = speed
+    elif backend == "qwen_api":
+        url = endpoint_url(config["clone_url"], "/v1/voice-clone")
+        payload = {
+            "text": text,
+            "language": "Auto",
+            "ref_text": ref_text,
+            "ref_audio_base64": ref_audio_b64,
+            "response_format": "wav",
+        }
+    else:
+        raise FatalError(f"Unsupported TTS backend for synthesis: {backend}")
+    return url, payload
+
+
+def build_clone_batch_request(config, group):
+    """
+    qwen_api 的批量克隆请求，group 为 [(text, voice_key, ref_audio_b64, ref_text)]。
+    同一批里每个角色的参考音只放进 voices 一次，条目按 voice_id 引用。
+    """
+    url = endpoint_url(config["clone_url"], "/v1/voice-clone/batch")
+    voices = {}
+    items = []
+    for text, voice_key, ref_audio_b64, ref_text in group:
+        voices.setdefault(voice_key, {"ref_text": ref_text, "ref_audio_base64": ref_audio_b64})
+        items.append({"text": text, "language": "Auto", "voice_id": voice_key})
+    return url, {"items": items, "voices": voices, "response_format": "wav"}
+
+
+def synthesis_cache_key(config, url, payload, ref_audio_sha256, voice_revision, speed):
+    """缓存键：请求里除参考音本体以外的全部字段（文本、模型地址、采样参数）+ 参考音哈希 + 音色版本 + 语速"""
+    params = {k: v for k, v in payload.items() if k not in ("ref_audio", "ref_audio_base64")}
+    return audio_cache.cache_key(
+        {
+            "backend": config["backend"],
+            "url": url,
+            "params": params,
+            "ref_audio_sha256": ref_audio_sha256,
+            "voice_revision": voice_revision,
+            "speed": speed,
+        }
+    )
+
+
+async def call_clone_api_async(config, url, payload, save_path):
+    """用角色参考音克隆合成一句台词，响应体边收边写盘，需在 tts_client 的事件循环中 await"""
+    await tts_client.download(
+        config["backend"], url, save_path, json=payload, timeout=300, max_inflight=config.get("max_inflight")
+    )
+    return save_path
+
+
+async def call_clone_batch_async(config, url, payload, save_paths):
+    """
+    批量克隆，返回与 save_paths 对应的结果列表：成功为文件路径，单条失败为 FatalError。
+    服务按条返回二进制帧，每条音频收到就直接写到对应的文件，不经过 base64。
+    """
+    async with tts_client.stream(
+        config["backend"], url, json=payload, timeout=300, max_inflight=config.get("max_inflight")
+    ) as response:
+        metas = await tts_client.save_frames(
+            response, lambda meta: save_paths[meta["index"]] if 0 <= meta.get("index", -1) < len(save_paths) else None
+        )
+
+    results = {meta.get("index"): meta for meta in metas}
+    outcomes = []
+    for index, save_path in enumerate(save_paths):
+        meta = results.get(index) or {"error": "Missing item in batch response"}
+        if meta.get("error") or not meta.get("size"):
+            outcomes.append(FatalError(meta.get("error") or "Empty audio in batch response"))
+            continue
+        outcomes.append(save_path)
+    return outcomes
+
+
+async def _synthesize_group(config, url, payload, save_paths, batched):
+    """统一成「每行一个结果」：整组的 FatalError 记到组内每一行，可重试错误照常抛出"""
+    try:
+        if batched:
+            return await call_clone_batch_async(config, url, payload, save_paths)
+        return [await call_clone_api_async(config, url, payload, save_paths[0])]
+    except FatalError as e:
+        return [e] * len(save_paths)
+
+
+def _focus_position(db: Session, project_id: str, focus_line_id):
+    """光标所在台词的 order_index；未传或已被删除时返回 None，按阅读顺序调度"""
+    if focus_line_id is None:
+        return None
+    line = (
+        db.query(ScriptLine)
+        .filter(ScriptLine.project_id == project_id, ScriptLine.id == focus_line_id)
+        .first()
+    )
+    return (line.order_index or 0) if line else None
+
+
+def synthesis_script_handler(task: Task, db: Session):
+    payload = task.payload or {}
+    line_ids = payload.get("line_ids") or []
+    if not line_ids:
+        raise FatalError("Missing required payload field: line_ids")
+
+    rows = (
+        db.query(ScriptLine)
+        .filter(ScriptLine.project_id == task.project_id, ScriptLine.id.in_(line_ids))
+        .order_by(ScriptLine.order_index.asc(), ScriptLine.id.asc())
+        .all()
+    )
+    characters = {
+        c.id: c for c in db.query(Character).filter(Character.project_id == task.project_id).all()
+    }
+
+    output_dir = os.path.join(STORAGE_ROOT, "projects", task.project_id, "outputs")
+    os.makedirs(output_dir, exist_ok=True)
+    tts_config = get_tts_config(db)
+    if tts_config["backend"] not in CLONE_BACKENDS:
+        raise FatalError(f"TTS backend {tts_config['backend']} does not support script line synthesis")
+    batch_size = get_batch_size(db) * clone_replicas(tts_config)
+    focus = _focus_position(db, task.project_id, payload.get("focus_line_id"))
+
+    done_ids = []
+    failed = []
+    todo = []
+    for line in rows:
+        # 文件名带任务 id：任务重试时，上一轮已经写好的行直接跳过
+        filename = f"line_{line.id}_{task.id[:8]}.wav"
+        if line.audio_path == filename and line.status == "synthesized":
+            done_ids.append(line.id)
+            continue
+        if not (line.text or "").strip():
+            failed.append({"line_id": line.id, "error": "Empty text"})
+            continue
+        char = characters.get(line.character_id)
+        if not char:
+            failed.append({"line_id": line.id, "error": "No character assigned"})
+            continue
+        todo.append((line, char, filename))
+
+    progress = ProgressReporter(task, total=len(rows))
+    if done_ids or failed:
+        progress.advance(count=len(done_ids) + len(failed))
+
+    cache_max_bytes = audio_cache.get_max_bytes(db)
+
+    # 每个角色的参考音只读一次：(base64, sha256)
+    ref_cache = {}
+
+    def ref_for(char):
+        if char.id not in ref_cache:
+            with open(resolve_ref_audio_path(char), "rb") as f:
+                data = f.read()
+            ref_cache[char.id] = (base64.b64encode(data).decode("ascii"), hashlib.sha256(data).hexdigest())
+        return ref_cache[char.id]
+
+    def finish_line(line, char, filename, save_path):
+        old_path = line.audio_path
+        line.audio_path = filename
+        line.duration = round(audio_duration(save_path), 3)
+        line.status = "synthesized"
+        line.last_synth_voice_revision = int(char.voice_revision or 1)
+        db.commit()
+        if old_path and old_path != filename and not old_path.startswith("/static/"):
+            old_disk = os.path.join(output_dir, old_path)
+            if os.path.isfile(old_disk):
+                os.remove(old_disk)
+        done_ids.append(line.id)
+        progress.advance(line.id)
+
+    # qwen_api 一个请求带多行，由模型服务在一次 generate 里批量合成；其余后端逐行请求
+    lines_per_request = tts_config.get("batch_lines", 1) if tts_config["backend"] == "qwen_api" else 1
+
+    # 先处理缓存命中和参考音缺失的行，剩下的才需要请求 TTS
+    cache_hits = 0
+    pending = []
+    for line, char, filename in todo:
+        try:
+            ref_b64, ref_sha = ref_for(char)
+        except FatalError as e:
+            failed.append({"line_id": line.id, "error": str(e)})
+            progress.advance(line.id)
+            continue
+        save_path = os.path.join(output_dir, filename)
+        speed = line.speed or 1.0
+        url, request = build_clone_request(tts_config, line.text, ref_b64, char.ref_text or "", speed)
+        key = synthesis_cache_key(
+            tts_config, url, request, ref_sha, int(char.voice_revision or 1), speed
+        )
+        if cache_max_bytes > 0 and audio_cache.fetch(key, save_path):
+            cache_hits += 1
+            finish_line(line, char, filename, save_path)
+            continue
+        pending.append((line, char, filename, key, save_path, (url, request)))
+
+    # 按角色分组：离光标近的台词先发，同一段内同一角色的台词连续发出，模型服务的 speaker prompt 缓存不被来回挤掉
+    def line_speaker(entry):
+        return entry[1].id
+
+    windows = plan_speaker_runs(
+        pending,
+        line_speaker,
+        lambda entry: entry[0].order_index or 0,
+        batch_size * lines_per_request * SCHEDULE_WINDOW_ROUNDS,
+        focus,
+    )
+    if pending:
+        logger.info(
+            f"Task {task.id}: speaker switches {speaker_switches(pending, line_speaker)} -> "
+            f"{speaker_switches([entry for run in windows for entry in run], line_speaker)}"
+        )
+
+    if lines_per_request > 1:
+        # 长度分桶：同一批只放长度相近的句子，减少批内对齐到最长句的填充；分桶在每段内做，不打乱段的先后
+        def line_tokens(entry):
+            return estimate_tokens(entry[0].text, entry[0].speed or 1.0)
+
+        groups = [batch for run in windows for batch in plan_batches(run, lines_per_request, line_tokens)]
+        if groups:
+            logger.info(
+                f"Task {task.id}: {len(pending)} lines in {len(groups)} batches, "
+                f"estimated padding {padding_ratio(groups, line_tokens):.0%}"
+            )
+    else:
+        groups = [[entry] for run in windows for entry in run]
+
+    # 滑动窗口：始终保持 batch_size 个请求在途，完成一个补一个，结果在本线程落库
+    in_flight = {}
+    queue = iter(groups)
+    try:
+        while True:
+            while len(in_flight) < batch_size:
+                group = next(queue, None)
+                if group is None:
+                    break
+                save_paths = [entry[4] for entry in group]
+                if lines_per_request > 1:
+                    url, request = build_clone_batch_request(
+                        tts_config,
+                        [(line.text, char.id, ref_for(char)[0], char.ref_text or "") for line, char, *_ in group],
+                    )
+                else:
+                    url, request = group[0][5]
+                future = tts_client.submit(
+                    _synthesize_group(tts_config, url, request, save_paths, lines_per_request > 1)
+                )
+                in_flight[future] = group
+            if not in_flight:
+                break
+
+            finished, _ = wait(list(in_flight), timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in finished:
+                group = in_flight.pop(future)
+                for (line, char, filename, key, _path, _req), outcome in zip(group, future.result()):
+                    if isinstance(outcome, FatalError):
+                        # 单行的请求错误（如文本不被接受）不影响其他行
+                        logger.error(f"Line {line.id} synthesis failed: {outcome}")
+                        failed.append({"line_id": line.id, "error": str(outcome)})
+                        progress.advance(line.id)
+                        continue
+                    speed = line.speed or 1.0
+                    if speed != 1.0 and tts_config["backend"] in POST_SPEED_BACKENDS:
+                        try:
+                            apply_speed(outcome, speed)
+                        except Exception as e:
+                            logger.error(f"Line {line.id} speed change failed: {e}")
+                            failed.append({"line_id": line.id, "error": f"Speed change failed: {e}"})
+                            progress.advance(line.id)
+                            continue
+                    audio_cache.store(key, outcome, cache_max_bytes)
+                    finish_line(line, char, filename, outcome)
+            raise_if_cancelled(task.id)
+    finally:
+        # 取消/可重试错误时丢弃还没完成的请求，已落库的行在重试时会被跳过
+        for future in in_flight:
+            future.cancel()
+        progress.flush()
+
+    if failed and not done_ids:
+        raise FatalError(f"All {len(failed)} lines failed, first error: {failed[0]['error']}")
+    # 合成按角色乱序完成，结果按剧本顺序返回
+    done = set(done_ids)
+    position = {line.id: index for index, line in enumerate(rows)}
+    failed.sort(key=lambda item: position.get(item["line_id"], len(rows)))
+    return {"line_ids": [line.id for line in rows if line.id in done], "failed": failed, "cache_hits": cache_hits}
@@ -1,11 +1,15 @@
 import os
 import uuid
-import requests
+import asyncio
 import base64
 import logging
-import json
+import httpx
 from sqlalchemy.orm import Session
 from database import Task, Config, Character, Project
+from . import tts_client
+from .cancellation import TaskCancelled, raise_if_cancelled
+from .errors import RetryableError
+from .tts_pool import EndpointsUnavailable, endpoint_url
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,13 +23,30 @@ def get_tts_config(db: Session):
 
     if backend_value == "local_vllm":
         vd_url = db.query(Config).filter(Config.key == "tts.vllm.vd_url").first()
+        base_url = db.query(Config).filter(Config.key == "tts.vllm.base_url").first()
         config.update({
-            "vd_url": vd_url.value if vd_url else "http://localhost:6006"
+            "vd_url": vd_url.value if vd_url else "http://localhost:6006",
+            "base_url": base_url.value if base_url else "http://localhost:6008"
         })
     elif backend_value == "autodl":
         vd_port = db.query(Config).filter(Config.key == "tts.autodl.vd_port").first()
+        base_port = db.query(Config).filter(Config.key == "tts.autodl.base_port").first()
         config.update({
-            "vd_port": vd_port.value if vd_port else "6006"
+            "vd_port": vd_port.value if vd_port else "6006",
+            "base_port": base_port.value if base_port else "6008"
+        })
+    elif backend_value == "qwen_api":
+        vd_url = db.query(Config).filter(Config.key == "tts.qwen_api.vd_url").first()
+        clone_url = db.query(Config).filter(Config.key == "tts.qwen_api.clone_url").first()
+        batch_lines = db.query(Config).filter(Config.key == "tts.qwen_api.batch_lines").first()
+        try:
+            batch_lines_value = max(int(float(batch_lines.value)), 1) if batch_lines and batch_lines.value else 8
+        except (TypeError, ValueError):
+            batch_lines_value = 8
+        config.update({
+            "vd_url": vd_url.value if vd_url else "http://localhost:8001",
+            "clone_url": clone_url.value if clone_url else "http://localhost:8002",
+            "batch_lines": batch_lines_value
         })
     elif backend_value == "aliyun":
         api_key = db.query(Config).filter(Config.key == "tts.aliyun.api_key").first()
@@ -36,18 +57,32 @@ def get_tts_config(db: Session):
         })
     else:
         raise ValueError(f"Unsupported TTS backend: {backend_value}")
+
+    max_inflight = db.query(Config).filter(Config.key == "tts.max_inflight").first()
+    try:
+        config["max_inflight"] = int(max_inflight.value) if max_inflight else tts_client.DEFAULT_MAX_INFLIGHT
+    except (TypeError, ValueError):
+        config["max_inflight"] = tts_client.DEFAULT_MAX_INFLIGHT
     
     return config
 
-def call_tts_api(config, payload, save_path):
+# 4 的倍数，保证每段 base64 都能独立解码
+B64_DECODE_CHUNK = 64 * 1024
+
+
+def _write_b64_file(path, data: str):
+    """分段解码 base64 写盘，不在内存里再拼一份完整的解码结果"""
+    with open(path, "wb") as f:
+        for start in range(0, len(data), B64_DECODE_CHUNK):
+            f.write(base64.b64decode(data[start:start + B64_DECODE_CHUNK]))
+
+
+async def call_tts_api_async(config, payload, save_path):
+    """走共享连接池发请求，需在 tts_client 的事件循环中 await"""
     backend = config["backend"]
-    
-    if backend == "autodl":
-        port = config["vd_port"]
-        url = f"http://127.0.0.1:{port}/v1/audio/speech"
-    elif backend == "local_vllm":
-        url = config["vd_url"] + "/v1/audio/speech"
-    elif backend == "aliyun":
+    max_inflight = config.get("max_inflight")
+
+    if backend == "aliyun":
         if config.get("region") == "singapore":
             url = "https://dashscope-intl.aliyuncs.com/api/v1/services/audio/tts/customization"
         else:
@@ -74,33 +109,52 @@ def call_tts_api(config, payload, save_path):
             }
         }
         
-        response = requests.post(url, json=api_payload, headers=headers, timeout=60)
-        
-        if response.status_code == 200:
-            result = response.json()
-            base64_audio = result["output"]["preview_audio"]["data"]
-            audio_bytes = base64.b64decode(base64_audio)
-            with open(save_path, "wb") as f:
-                f.write(audio_bytes)
-            return save_path
+        response = await tts_client.post(
+            backend, url, json=api_payload, headers=headers, timeout=60, max_inflight=max_inflight
+        )
+        # DashScope 只能返回内嵌在 JSON 里的 base64
+        base64_audio = response.json()["output"]["preview_audio"]["data"]
+        await asyncio.to_thread(_write_b64_file, save_path, base64_audio)
+    else:
+        if backend == "autodl":
+            url = endpoint_url(config["vd_port"], "/v1/audio/speech")
+        elif backend == "local_vllm":
+            url = endpoint_url(config["vd_url"], "/v1/audio/speech")
+        elif backend == "qwen_api":
+            # models_deploy 里的 REST 服务，字段名与 vLLM 的 speech 接口不同
+            url = endpoint_url(config["vd_url"], "/v1/voice-design")
+            payload = {
+                "text": payload["input"],
+                "instruct": payload.get("instructions", ""),
+                "language": payload.get("language", "Auto"),
+                "max_new_tokens": payload.get("max_new_tokens"),
+                "response_format": "wav",
+            }
         else:
-            raise Exception(f"Aliyun TTS API error: {response.status_code} - {response.text}")
-    
-    if backend != "aliyun":
+            raise ValueError(f"Unsupported TTS backend: {backend}")
+
         try:
-            response = requests.post(url, json=payload, timeout=120)
-            
-            if response.status_code != 200:
-                raise Exception(f"TTS API error: {response.status_code} - {response.text}")
-            
-            with open(save_path, "wb") as f:
-                f.write(response.content)
-                
-        except requests.exceptions.ConnectionError:
-            raise Exception(f"Connection refused. Please check if SSH tunnel is open for port {config.get('vd_port', '6006')}")
-    
+            await tts_client.download(
+                backend, url, save_path, json=payload, timeout=120, max_inflight=max_inflight
+            )
+        except RetryableError as e:
+            # autodl 的端点已熔断时直接失败，同样多半是隧道没开
+            down = isinstance(e, EndpointsUnavailable) and backend == "autodl"
+            if isinstance(e.__cause__, httpx.ConnectError) or down:
+                raise RetryableError(
+                    f"Connection refused. Please check if SSH tunnel is open for port {config.get('vd_port', '6006')}"
+                ) from e
+            raise
+
     return save_path
 
+
+def call_tts_api(config, payload, save_path, cancel_check=None):
+    """同步入口，供 Worker 线程调用；cancel_check：发起 HTTP 请求前调用的取消检查，任务已取消时应抛出异常"""
+    if cancel_check:
+        cancel_check()
+    return tts_client.run(call_tts_api_async(config, payload, save_path))
+
 def synthesis_voicedesign_handler(task: Task, db: Session):
     payload = task.payload
     character_id = payload.get("character_id")
@@ -135,7 +189,9 @@ def synthesis_voicedesign_handler(task: Task, db: Session):
     save_path = os.path.join(temp_dir, temp_filename)
     
     try:
-        call_tts_api(tts_config, api_payload, save_path)
+        call_tts_api(tts_config, api_payload, save_path, cancel_check=lambda: raise_if_cancelled(task.id))
+        # 生成期间被取消时不覆盖角色当前的参考音
+        raise_if_cancelled(task.id)
         char.ref_audio_path = temp_filename
         char.is_confirmed = False  
         
@@ -143,6 +199,10 @@ def synthesis_voicedesign_handler(task: Task, db: Session):
         
         audio_url = f"/static/temp/{temp_filename}"
         return {"audio_url": audio_url}
+    except TaskCancelled:
+        if os.path.exists(save_path):
+            os.remove(save_path)
+        raise
     except Exception as e:
         logger.error(f"VoiceDesign synthesis failed: {e}")
         raise e
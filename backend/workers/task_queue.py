@@ -0,0 +1,438 @@
+"""任务入队 + 进程内调度唤醒 + 原子领取 + 租约续期/回收"""
+
+import datetime
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import Session
+from database import Task, Project, Character, ScriptLine
+from .cancellation import mark_cancel_requested
+from .events import publish_task
+
+
+# 每个进程一个 Worker 标识，写入 Task.worker_id 便于排查是谁领走了任务
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+LEASE_SECONDS = 60
+# 每类任务的执行次数上限（含首次），暂时性失败重试或租约过期回收都会消耗次数，
+# 用尽后进入 dead_letter，避免毒任务反复拖垮 Worker
+DEFAULT_MAX_ATTEMPTS = 3
+TASK_MAX_ATTEMPTS = {
+    "synthesis_voicedesign": 3,
+    "analyze_char": 3,
+    "synthesis_script": 5,
+}
+# 退避：base * 2^(n-1)，封顶 cap，再取 [50%, 100%] 的随机抖动，避免故障恢复时所有任务同时重试
+RETRY_BACKOFF_BASE = 2.0
+RETRY_BACKOFF_CAP = 300.0
+# 条件更新失败（被其他进程抢走）时，同一轮最多再尝试的候选数
+CLAIM_CANDIDATES = 5
+
+# 调度通道（数值越小越优先）：交互试听 > 角色分析 > 批量台词合成 > 导出
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ANALYSIS = 10
+PRIORITY_BULK = 20
+PRIORITY_EXPORT = 30
+TASK_PRIORITIES = {
+    "synthesis_voicedesign": PRIORITY_INTERACTIVE,
+    "analyze_char": PRIORITY_ANALYSIS,
+    "synthesis_script": PRIORITY_BULK,
+}
+DEFAULT_PRIORITY = PRIORITY_BULK
+# 防饥饿：排队超过该时长的任务不再区分通道，按入队先后执行
+STARVATION_SECONDS = 300
+
+# 相同载荷的重复提交合并为同一个任务：排队/执行中的直接复用；
+# 刚完成不久的成功结果在调用方确认仍然有效时也复用（防连点，不影响有意的“再生成一次”）
+COALESCED_TASK_TYPES = {"synthesis_voicedesign"}
+COALESCE_RECENT_SECONDS = 10
+
+_wakeup = threading.Event()
+
+
+def notify_worker():
+    """唤醒调度线程：有新任务入队或有任务执行完释放了空位"""
+    _wakeup.set()
+
+
+def wait_for_work(timeout: float) -> bool:
+    """阻塞到被唤醒或超时；超时时调度线程回退为一次数据库轮询"""
+    woke = _wakeup.wait(timeout)
+    # 先清标志再查库，清除之前的通知对应的任务一定已提交，不会漏掉
+    _wakeup.clear()
+    return woke
+
+
+def compute_payload_hash(project_id: str, task_type: str, payload: Optional[Dict[str, Any]]) -> str:
+    canonical = json.dumps(
+        {"project_id": project_id, "type": task_type, "payload": payload or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def not_cancel_requested():
+    """查询条件：未被请求取消（旧行的 cancel_requested 可能为 NULL）"""
+    return or_(Task.cancel_requested.is_(None), Task.cancel_requested.is_(False))
+
+
+def find_duplicate_task(
+    db: Session,
+    payload_hash: str,
+    reuse_result: Optional[Callable[[Task], bool]] = None,
+) -> Optional[Task]:
+    """查找可合并的同载荷任务：优先排队/执行中的，其次是刚成功且 reuse_result 认可的"""
+    in_flight = (
+        db.query(Task)
+        .filter(
+            Task.payload_hash == payload_hash,
+            Task.status.in_(("pending", "processing")),
+            not_cancel_requested(),
+        )
+        .order_by(Task.created_at.desc())
+        .first()
+    )
+    if in_flight or reuse_result is None:
+        return in_flight
+
+    recent_after = datetime.datetime.now() - datetime.timedelta(seconds=COALESCE_RECENT_SECONDS)
+    recent = (
+        db.query(Task)
+        .filter(
+            Task.payload_hash == payload_hash,
+            Task.status == "success",
+            Task.finished_at >= recent_after,
+        )
+        .order_by(Task.finished_at.desc())
+        .first()
+    )
+    if recent and reuse_result(recent):
+        return recent
+    return None
+
+
+def submit_task(
+    db: Session,
+    project_id: str,
+    task_type: str,
+    payload: Optional[Dict[str, Any]] = None,
+    priority: Optional[int] = None,
+    reuse_result: Optional[Callable[[Task], bool]] = None,
+) -> Task:
+    """
+    创建 pending 任务并立即唤醒 Worker，会一并提交 db 中已有的改动。
+    COALESCED_TASK_TYPES 中的类型遇到同载荷的任务时直接返回已有任务，不再新建；
+    reuse_result 用于判断刚完成的结果是否仍可直接复用。
+    """
+    if priority is None:
+        priority = TASK_PRIORITIES.get(task_type, DEFAULT_PRIORITY)
+
+    payload_hash = None
+    if task_type in COALESCED_TASK_TYPES:
+        payload_hash = compute_payload_hash(project_id, task_type, payload)
+        duplicate = find_duplicate_task(db, payload_hash, reuse_result)
+        if duplicate:
+            # 调用方可能带着未提交的改动（如项目状态），保持与新建任务一致的提交语义
+            db.commit()
+            return duplicate
+
+    task = Task(
+        id=str(uuid.uuid4()),
+        project_id=project_id,
+        type=task_type,
+        status="pending",
+        payload=payload or {},
+        priority=priority,
+        payload_hash=payload_hash,
+    )
+    db.add(task)
+    db.commit()
+    notify_worker()
+    publish_task(task)
+    return task
+
+
+def claim_task(
+    db: Session,
+    exclude_types: Optional[List[str]] = None,
+    max_priority: Optional[int] = None,
+) -> Optional[Task]:
+    """
+    原子领取一个 pending 任务，多个进程同时领取也不会重复执行。
+    通过带 status 条件的 UPDATE 抢占，只有 rowcount == 1 的一方算领取成功；
+    PostgreSQL 上额外用 FOR UPDATE SKIP LOCKED 选候选行，避免多个 Worker 争同一行。
+    按 priority 取最优先的通道，等待超过 STARVATION_SECONDS 的任务提到最前；
+    max_priority 用于只领取不低于该优先级的任务（给交互通道预留的空位）。
+    """
+    now = datetime.datetime.now()
+    priority = func.coalesce(Task.priority, DEFAULT_PRIORITY)
+    starving_before = now - datetime.timedelta(seconds=STARVATION_SECONDS)
+    effective_priority = case(
+        (Task.created_at < starving_before, PRIORITY_INTERACTIVE - 1),
+        else_=priority,
+    )
+
+    query = db.query(Task.id).filter(
+        Task.status == "pending",
+        or_(Task.next_attempt_at.is_(None), Task.next_attempt_at <= now),
+        not_cancel_requested(),
+    )
+    if exclude_types:
+        query = query.filter(Task.type.notin_(exclude_types))
+    if max_priority is not None:
+        query = query.filter(priority <= max_priority)
+    query = query.order_by(effective_priority, Task.created_at)
+
+    if db.get_bind().dialect.name == "postgresql":
+        candidates = query.limit(1).with_for_update(skip_locked=True).all()
+    else:
+        candidates = query.limit(CLAIM_CANDIDATES).all()
+
+    for (task_id,) in candidates:
+        now = datetime.datetime.now()
+        updated = (
+            db.query(Task)
+            .filter(Task.id == task_id, Task.status == "pending", not_cancel_requested())
+            .update(
+                {
+                    Task.status: "processing",
+                    Task.worker_id: WORKER_ID,
+                    Task.lease_expires_at: now + datetime.timedelta(seconds=LEASE_SECONDS),
+                    Task.heartbeat_at: now,
+                    Task.attempts: func.coalesce(Task.attempts, 0) + 1,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if updated == 1:
+            return db.query(Task).filter(Task.id == task_id).first()
+    return None
+
+
+def max_attempts_for(task_type: str) -> int:
+    return TASK_MAX_ATTEMPTS.get(task_type, DEFAULT_MAX_ATTEMPTS)
+
+
+def retry_delay(attempts: int) -> float:
+    """第 attempts 次执行失败后，到下一次执行前的等待秒数"""
+    delay = min(RETRY_BACKOFF_CAP, RETRY_BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def renew_leases(db: Session, task_ids: List[str]) -> List[str]:
+    """为本进程正在执行的任务续租，返回已经丢失租约（被回收或改派）的任务 id"""
+    lost = []
+    now = datetime.datetime.now()
+    for task_id in task_ids:
+        updated = (
+            db.query(Task)
+            .filter(
+                Task.id == task_id,
+                Task.status == "processing",
+                Task.worker_id == WORKER_ID,
+            )
+            .update(
+                {
+                    Task.heartbeat_at: now,
+                    Task.lease_expires_at: now + datetime.timedelta(seconds=LEASE_SECONDS),
+                },
+                synchronize_session=False,
+            )
+        )
+        if updated != 1:
+            lost.append(task_id)
+    db.commit()
+    return lost
+
+
+def reap_expired_tasks(db: Session) -> int:
+    """
+    回收租约已过期的 processing 任务（Worker 崩溃/重启遗留）：
+    未用尽执行次数的重新排队，否则进入 dead_letter。返回重新排队的数量。
+    """
+    now = datetime.datetime.now()
+    expired = (
+        db.query(Task)
+        .filter(
+            Task.status == "processing",
+            # 租约为空的是加租约字段之前遗留的行，同样视为过期
+            or_(Task.lease_expires_at.is_(None), Task.lease_expires_at < now),
+        )
+        .all()
+    )
+    requeued = 0
+    changed = []
+    for task in expired:
+        attempts = int(task.attempts or 0)
+        exhausted = attempts >= max_attempts_for(task.type)
+        cancelled = bool(task.cancel_requested)
+        if cancelled:
+            next_status = "cancelled"
+        elif exhausted:
+            next_status = "dead_letter"
+        else:
+            next_status = "pending"
+        # 以“仍是过期时的持有者”为条件，避免和刚续租成功的 Worker 冲突
+        updated = (
+            db.query(Task)
+            .filter(
+                Task.id == task.id,
+                Task.status == "processing",
+                or_(Task.lease_expires_at.is_(None), Task.lease_expires_at < now),
+            )
+            .update(
+                {
+                    Task.status: next_status,
+                    Task.worker_id: None,
+                    Task.lease_expires_at: None,
+                    Task.finished_at: None if next_status == "pending" else now,
+                    Task.error_msg: (
+                        f"Worker lease expired after {attempts} attempts"
+                        if next_status == "dead_letter"
+                        else task.error_msg
+                    ),
+                },
+                synchronize_session=False,
+            )
+        )
+        if updated != 1:
+            continue
+        changed.append(task)
+        if next_status == "cancelled":
+            restore_project_state(db, task)
+        elif next_status == "dead_letter":
+            fail_project_state(db, task)
+        else:
+            requeued += 1
+    db.commit()
+    for task in changed:
+        publish_task(task)
+    return requeued
+
+
+def line_is_stale(line: ScriptLine, char_revisions: Dict[str, int]) -> bool:
+    """已合成、且合成时的音色版本与角色当前版本不一致（或角色已不存在）"""
+    if line.status != "synthesized" or not line.character_id:
+        return False
+    current_rev = char_revisions.get(line.character_id)
+    if current_rev is None:
+        return True
+    return int(line.last_synth_voice_revision or 0) != int(current_rev)
+
+
+def timeline_ready(characters: List[Character], lines: List[ScriptLine]) -> bool:
+    """pipeline-status 的 can_enter_timeline：角色全部确认，且每一行都已按角色当前音色合成"""
+    if not characters or any(not c.is_confirmed for c in characters) or not lines:
+        return False
+    revisions = {c.id: int(c.voice_revision or 1) for c in characters}
+    return all(line.status == "synthesized" and not line_is_stale(line, revisions) for line in lines)
+
+
+def script_pipeline_state(db: Session, project_id: str) -> str:
+    """台词合成结束后的项目状态：满足 timeline_ready 时为 completed，否则退回 script_ready"""
+    characters = db.query(Character).filter(Character.project_id == project_id).all()
+    lines = db.query(ScriptLine).filter(ScriptLine.project_id == project_id).all()
+    return "completed" if timeline_ready(characters, lines) else "script_ready"
+
+
+def settle_synthesis_state(db: Session, task: Task):
+    """synthesis_script 结束（成功/失败/取消）后更新项目状态，同项目还有合成任务排队或执行时保持 synthesizing；不提交"""
+    project = db.query(Project).filter(Project.id == task.project_id).first()
+    if not project or project.state != "synthesizing":
+        return
+    active = (
+        db.query(Task.id)
+        .filter(
+            Task.project_id == task.project_id,
+            Task.type == "synthesis_script",
+            Task.id != task.id,
+            Task.status.in_(("pending", "processing")),
+        )
+        .first()
+    )
+    if active is None:
+        project.state = script_pipeline_state(db, project.id)
+
+
+def queued_synthesis_lines(db: Session, project_id: str) -> Dict[int, str]:
+    """项目里排队或执行中的 synthesis_script 任务已包含的行：line_id -> task_id"""
+    tasks = (
+        db.query(Task)
+        .filter(
+            Task.project_id == project_id,
+            Task.type == "synthesis_script",
+            Task.status.in_(("pending", "processing")),
+        )
+        .all()
+    )
+    return {line_id: task.id for task in tasks for line_id in (task.payload or {}).get("line_ids") or []}
+
+
+def restore_project_state(db: Session, task: Task):
+    """任务被取消后，把项目从“进行中”状态退回，不提交"""
+    project = db.query(Project).filter(Project.id == task.project_id).first()
+    if not project:
+        return
+    if task.type == "analyze_char" and project.state == "analyzing_characters":
+        has_characters = (
+            db.query(Character.id).filter(Character.project_id == project.id).first() is not None
+        )
+        project.state = "characters_ready" if has_characters else "created"
+    elif task.type == "synthesis_script":
+        settle_synthesis_state(db, task)
+
+
+def fail_project_state(db: Session, task: Task):
+    """
+    任务最终失败（failed / dead_letter）后更新项目状态，不提交。
+    台词合成失败不锁住项目：已合成的行仍有效，按台词状态退回 script_ready / completed，可以直接重新合成
+    """
+    if task.type == "synthesis_script":
+        settle_synthesis_state(db, task)
+        return
+    project = db.query(Project).filter(Project.id == task.project_id).first()
+    if project:
+        project.state = "failed"
+
+
+def cancel_task(db: Session, task_id: str) -> Optional[Task]:
+    """
+    取消任务：pending 直接标记 cancelled；processing 只打取消标记，
+    由执行它的 Worker 在 handler 下一个检查点退出。已结束的任务原样返回。
+    """
+    updated = (
+        db.query(Task)
+        .filter(Task.id == task_id, Task.status == "pending")
+        .update(
+            {
+                Task.status: "cancelled",
+                Task.cancel_requested: True,
+                Task.finished_at: datetime.datetime.now(),
+            },
+            synchronize_session=False,
+        )
+    )
+    if updated == 1:
+        task = db.query(Task).filter(Task.id == task_id).first()
+        restore_project_state(db, task)
+        db.commit()
+        publish_task(task)
+        return task
+
+    updated = (
+        db.query(Task)
+        .filter(Task.id == task_id, Task.status == "processing")
+        .update({Task.cancel_requested: True}, synchronize_session=False)
+    )
+    db.commit()
+    if updated == 1:
+        mark_cancel_requested(task_id)
+    return db.query(Task).filter(Task.id == task_id).first()
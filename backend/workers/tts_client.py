@@ -0,0 +1,390 @@
+"""
+TTS 请求的异步 I/O 通道：一个常驻事件循环线程 + 共享的 httpx.AsyncClient。
+
+- 连接池复用 keep-alive 连接，不再每次请求都重新建连
+- 每个 TTS 后端一个信号量，限制同时在途的请求数，超出的在事件循环里排队而不是占线程
+- Worker 线程通过 run() 同步等待单个请求，或用 submit() 一次性投递多个请求并发执行，
+  在途请求再多也只占用这一个 I/O 线程
+- 音频响应用 download() / save_frames() 边收边写盘，不在内存里攒整段响应
+- 地址为 tts_pool.PoolURL 时，在后端的多个副本里按最少在途请求选一个端点发送
+- 端点出现网络错误后熔断，后台定期探测 /v1/health，恢复后重新接收请求
+"""
+
+import asyncio
+import json as json_lib
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, List, Optional
+import httpx
+from .errors import FatalError, RetryableError, is_retryable_status
+from .tts_pool import EndpointPool, EndpointSpec, PoolURL, breaker_for, breakers, reset_breakers
+
+
+# 单个后端的默认在途请求上限，可用配置项 tts.max_inflight 覆盖
+DEFAULT_MAX_INFLIGHT = 64
+MAX_CONNECTIONS = 256
+MAX_KEEPALIVE_CONNECTIONS = 64
+KEEPALIVE_EXPIRY = 30.0
+CONNECT_TIMEOUT = 10.0
+DEFAULT_TIMEOUT = 120.0
+# 流式读取响应体的块大小
+CHUNK_SIZE = 64 * 1024
+# 端点探活：models_deploy 服务的健康检查接口；vLLM 没有这个路径会返回 404，能收到响应即视为存活
+HEALTH_PATH = "/v1/health"
+PROBE_INTERVAL = 10.0
+PROBE_TIMEOUT = 3.0
+# 超过这么久没有请求的健康端点不再探测，避免配置改掉的旧地址一直被探
+PROBE_IDLE_AFTER = 300.0
+
+# httpx 默认每个请求打一条 INFO，批量合成时会刷屏
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+_thread: Optional[threading.Thread] = None
+_start_lock = threading.Lock()
+# 只在事件循环线程内访问
+_semaphores: Dict[str, tuple[int, asyncio.Semaphore]] = {}
+# 按端点列表共享的负载均衡池，同样只在事件循环线程内访问
+_pools: Dict[tuple[EndpointSpec, ...], EndpointPool] = {}
+_prober: Optional[asyncio.Task] = None
+# shutdown() 进行中：此时被取消的请求以 TTSClientClosed 结束，而不是让等待方一直挂着
+_closing = False
+
+
+class TTSClientClosed(RetryableError):
+    """I/O 线程已关闭时仍在途的请求；任务按可重试错误重新排队"""
+
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread
+    with _start_lock:
+        if _loop is not None and _thread is not None and _thread.is_alive():
+            return _loop
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def _run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+            loop.close()
+
+        thread = threading.Thread(target=_run, name="tts-io", daemon=True)
+        thread.start()
+        ready.wait()
+        _loop, _thread = loop, thread
+        return loop
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+    return _client
+
+
+def _get_semaphore(backend: str, limit: int) -> asyncio.Semaphore:
+    # 配置改了上限就换一个新信号量，旧信号量上的请求照常结束
+    current = _semaphores.get(backend)
+    if current is None or current[0] != limit:
+        current = (limit, asyncio.Semaphore(limit))
+        _semaphores[backend] = current
+    return current[1]
+
+
+def _get_pool(endpoints: tuple[EndpointSpec, ...]) -> EndpointPool:
+    # 配置改了（增删端点、改权重）就换一个新池，旧池上的请求照常结束
+    pool = _pools.get(endpoints)
+    if pool is None:
+        pool = EndpointPool(endpoints)
+        _pools[endpoints] = pool
+    _ensure_prober()
+    return pool
+
+
+def _is_connect_failure(exc: BaseException) -> bool:
+    # 连接被拒或连不上：端点进程不在，无需等连续失败
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+async def _probe(breaker):
+    try:
+        response = await _get_client().get(breaker.url + HEALTH_PATH, timeout=PROBE_TIMEOUT)
+    except (httpx.TimeoutException, httpx.TransportError) as e:
+        breaker.record_failure(e, immediate=_is_connect_failure(e))
+        return
+    if response.status_code >= 500:
+        breaker.record_failure(f"health check returned {response.status_code}")
+    else:
+        breaker.record_success()
+
+
+async def _probe_loop():
+    while True:
+        await asyncio.sleep(PROBE_INTERVAL)
+        now = time.monotonic()
+        targets = [b for b in breakers() if b.is_open or now - b.last_used < PROBE_IDLE_AFTER]
+        await asyncio.gather(*(_probe(b) for b in targets))
+
+
+def _ensure_prober():
+    global _prober
+    if _prober is None or _prober.done():
+        _prober = asyncio.get_running_loop().create_task(_probe_loop())
+
+
+@asynccontextmanager
+async def _acquire(backend: str, url: str, max_inflight: Optional[int]) -> AsyncIterator[str]:
+    """占用 backend 的并发额度；url 为端点池时再占用一个端点，返回实际请求的地址"""
+    semaphore = _get_semaphore(backend, max(1, int(max_inflight or DEFAULT_MAX_INFLIGHT)))
+    async with semaphore:
+        if not isinstance(url, PoolURL):
+            yield url
+            return
+        async with _get_pool(url.endpoints).lease() as base:
+            breaker = breaker_for(base)
+            try:
+                yield base + url.path
+            except RetryableError as e:
+                # 只有网络层失败计入熔断；服务返回了错误状态码说明端点还活着
+                if isinstance(e.__cause__, (httpx.TimeoutException, httpx.TransportError)):
+                    breaker.record_failure(e.__cause__, immediate=_is_connect_failure(e.__cause__))
+                raise
+            breaker.record_success()
+
+
+def _raise_for_status(response: httpx.Response):
+    if response.status_code != 200:
+        error_cls = RetryableError if is_retryable_status(response.status_code) else FatalError
+        raise error_cls(f"TTS API error: {response.status_code} - {response.text}")
+
+
+async def post(
+    backend: str,
+    url: str,
+    json: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+    max_inflight: Optional[int] = None,
+) -> httpx.Response:
+    """
+    在 backend 的并发额度内发起 POST，只能在 I/O 线程的事件循环中 await。
+    连接失败/超时转换为 RetryableError，非 200 按状态码转换为 RetryableError / FatalError。
+    """
+    async with _acquire(backend, url, max_inflight) as target:
+        try:
+            response = await _get_client().post(
+                target,
+                json=json,
+                headers=headers,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            )
+        except httpx.TimeoutException as e:
+            raise RetryableError(f"TTS request to {target} timed out: {e}") from e
+        except httpx.TransportError as e:
+            raise RetryableError(f"Cannot reach TTS service at {target}: {e}") from e
+
+    _raise_for_status(response)
+    return response
+
+
+@asynccontextmanager
+async def stream(
+    backend: str,
+    url: str,
+    json: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+    max_inflight: Optional[int] = None,
+) -> AsyncIterator[httpx.Response]:
+    """
+    流式 POST：响应体不整体读进内存，由调用方在 async with 内边收边处理。
+    占用 backend 的并发额度直到响应读完；错误转换规则与 post() 相同，读取过程中断开也算 RetryableError。
+    """
+    async with _acquire(backend, url, max_inflight) as target:
+        try:
+            async with _get_client().stream(
+                "POST",
+                target,
+                json=json,
+                headers=headers,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    _raise_for_status(response)
+                yield response
+        except httpx.TimeoutException as e:
+            raise RetryableError(f"TTS request to {target} timed out: {e}") from e
+        except httpx.TransportError as e:
+            raise RetryableError(f"Cannot reach TTS service at {target}: {e}") from e
+
+
+def _tmp_path(path: str) -> str:
+    return f"{path}.{uuid.uuid4().hex[:8]}.part"
+
+
+async def download(backend: str, url: str, save_path: str, **kwargs) -> int:
+    """
+    POST 后把响应体按块写到 save_path（先写临时文件再改名），返回写入的字节数。
+    写本地文件只是进页缓存，直接在事件循环里写，不为每个块切线程。
+    """
+    tmp = _tmp_path(save_path)
+    size = 0
+    try:
+        async with stream(backend, url, **kwargs) as response:
+            with open(tmp, "wb") as f:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+        os.replace(tmp, save_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return size
+
+
+class _FrameReader:
+    """按字节数读取流式响应，供二进制分帧响应解析用"""
+
+    def __init__(self, response: httpx.Response):
+        self._chunks = response.aiter_bytes(CHUNK_SIZE)
+        self._buffer = bytearray()
+        self._eof = False
+
+    async def _fill(self) -> bool:
+        if self._eof:
+            return False
+        try:
+            self._buffer += await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            return False
+        return True
+
+    async def read_exact(self, size: int) -> Optional[bytes]:
+        """读满 size 字节；流正好在帧边界结束时返回 None"""
+        while len(self._buffer) < size:
+            if not await self._fill():
+                if not self._buffer:
+                    return None
+                raise RetryableError("TTS response truncated")
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def copy_to(self, f, size: int):
+        while size > 0:
+            if not self._buffer and not await self._fill():
+                raise RetryableError("TTS response truncated")
+            take = min(size, len(self._buffer))
+            if f is not None:
+                f.write(self._buffer[:take])
+            del self._buffer[:take]
+            size -= take
+
+
+async def save_frames(
+    response: httpx.Response, path_for: Callable[[Dict[str, Any]], Optional[str]]
+) -> List[Dict[str, Any]]:
+    """
+    解析 models_deploy 批量接口的二进制帧（4 字节小端头长度 + JSON 头 + size 字节音频），
+    path_for(meta) 返回该帧音频的保存路径，音频按块直接写盘；返回全部帧头。
+    """
+    reader = _FrameReader(response)
+    metas = []
+    while True:
+        prefix = await reader.read_exact(4)
+        if prefix is None:
+            break
+        header = await reader.read_exact(struct.unpack("<I", prefix)[0])
+        if header is None:
+            raise RetryableError("TTS response truncated")
+        meta = json_lib.loads(header)
+        size = int(meta.get("size") or 0)
+        path = path_for(meta) if size and not meta.get("error") else None
+        if path is None:
+            await reader.copy_to(None, size)
+        else:
+            tmp = _tmp_path(path)
+            try:
+                with open(tmp, "wb") as f:
+                    await reader.copy_to(f, size)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        metas.append(meta)
+    return metas
+
+
+async def _guarded(coro: Coroutine):
+    try:
+        return await coro
+    except asyncio.CancelledError:
+        if _closing:
+            raise TTSClientClosed("TTS client is shutting down")
+        raise
+
+
+def submit(coro: Coroutine) -> Future:
+    """把协程投递到 I/O 线程，立即返回 concurrent.futures.Future，可一次投递多个并发执行"""
+    return asyncio.run_coroutine_threadsafe(_guarded(coro), _ensure_loop())
+
+
+def run(coro: Coroutine, timeout: Optional[float] = None):
+    """在 Worker 线程里同步等待协程结果，异常原样抛出"""
+    return submit(coro).result(timeout)
+
+
+async def _cancel_pending():
+    current = asyncio.current_task()
+    pending = [t for t in asyncio.all_tasks() if t is not current]
+    for t in pending:
+        t.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+def shutdown():
+    """
+    关闭连接池并停止 I/O 线程，服务退出时调用。仍在途的请求（含后台探活）全部取消，
+    等待它们的 Worker 线程收到 TTSClientClosed，不会因事件循环停止而永远等下去
+    """
+    global _loop, _client, _thread, _prober, _closing
+    with _start_lock:
+        loop, client, thread = _loop, _client, _thread
+        _loop, _client, _thread, _prober = None, None, None, None
+    if loop is None:
+        return
+    _closing = True
+    try:
+        asyncio.run_coroutine_threadsafe(_cancel_pending(), loop).result(5)
+    except Exception:
+        pass
+    if client is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(5)
+        except Exception:
+            pass
+    loop.call_soon_threadsafe(loop.stop)
+    if thread is not None:
+        thread.join(5)
+    _closing = False
+    _semaphores.clear()
+    _pools.clear()
+    reset_breakers()
@@ -0,0 +1,216 @@
+"""
+多端点 TTS 后端池：同一个模型起多份副本（如 models_deploy 的 docker-compose 里多个容器）时，
+地址配置项里写多个地址，请求按「在途数 / 权重」最小的端点分发。
+
+地址写法（逗号或换行分隔，# 后为可选参数）：
+
+    http://gpu0:8002, http://gpu1:8002#weight=2&max_inflight=8
+
+- weight：权重，默认 1，性能翻倍的机器设为 2 时分到的在途请求也翻倍
+- max_inflight：该端点同时在途的请求上限，默认不限（仍受 tts.max_inflight 总上限约束）
+- autodl 的端口配置项可以写多个端口，按 http://127.0.0.1:{port} 处理
+
+每个端点带一个熔断器：连接被拒立即熔断，超时等其他网络错误连续 FAILURE_THRESHOLD 次熔断。
+熔断的端点不再分到请求，由 tts_client 的后台探活恢复；全部端点都熔断时请求直接失败，不再逐个等超时。
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from .errors import FatalError, RetryableError
+
+LOCAL_HOST = "http://127.0.0.1"
+FAILURE_THRESHOLD = 3
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class EndpointSpec:
+    url: str
+    weight: float = 1.0
+    max_inflight: int = 0  # 0 表示不单独限制
+
+
+def parse_endpoints(value) -> Tuple[EndpointSpec, ...]:
+    """解析地址配置项，格式错误抛 FatalError（配置问题，重试也不会好）"""
+    specs = []
+    for raw in str(value or "").replace("\n", ",").split(","):
+        entry = raw.strip()
+        if not entry:
+            continue
+        address, _, options = entry.partition("#")
+        address = address.strip().rstrip("/")
+        if address.isdigit():
+            address = f"{LOCAL_HOST}:{address}"
+        try:
+            params = dict(parse_qsl(options, strict_parsing=bool(options)))
+            weight = float(params.pop("weight", 1))
+            max_inflight = int(params.pop("max_inflight", 0))
+        except ValueError as e:
+            raise FatalError(f"Invalid TTS endpoint option in {entry!r}: {e}") from e
+        if params or weight <= 0 or max_inflight < 0:
+            raise FatalError(f"Invalid TTS endpoint option in {entry!r}")
+        specs.append(EndpointSpec(url=address, weight=weight, max_inflight=max_inflight))
+    if not specs:
+        raise FatalError(f"No TTS endpoint configured: {value!r}")
+    return tuple(specs)
+
+
+class PoolURL(str):
+    """
+    指向端点池的请求地址。字符串值是第一个端点的完整地址，日志和合成缓存键都用它，
+    增删副本不会让已有缓存失效；tts_client 发请求时再按负载选出实际端点。
+    """
+
+    endpoints: Tuple[EndpointSpec, ...]
+    path: str
+
+    def __new__(cls, endpoints: Tuple[EndpointSpec, ...], path: str):
+        obj = super().__new__(cls, endpoints[0].url + path)
+        obj.endpoints = endpoints
+        obj.path = path
+        return obj
+
+
+def endpoint_url(value, path: str) -> PoolURL:
+    """配置项（一个或多个地址）+ 接口路径 -> PoolURL"""
+    return PoolURL(parse_endpoints(value), path)
+
+
+class EndpointsUnavailable(RetryableError):
+    """端点全部熔断，没有发请求就失败；任务按可重试错误退避后再试"""
+
+
+class CircuitBreaker:
+    """单个端点的健康状态，按地址全局共享（同一端点可能出现在多个池里）"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error = ""
+        self.last_used = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"TTS endpoint {self.url} is back after {time.monotonic() - self.opened_at:.0f}s")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, error, immediate: bool = False):
+        self.failures += 1
+        self.last_error = str(error) or type(error).__name__
+        if self.opened_at is None and (immediate or self.failures >= FAILURE_THRESHOLD):
+            self.opened_at = time.monotonic()
+            logger.warning(f"TTS endpoint {self.url} marked down: {self.last_error}")
+
+
+# 只在 tts_client 的事件循环线程内访问
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    breaker = _breakers.get(url)
+    if breaker is None:
+        breaker = CircuitBreaker(url)
+        _breakers[url] = breaker
+    return breaker
+
+
+def breakers() -> List[CircuitBreaker]:
+    return list(_breakers.values())
+
+
+def reset_breakers():
+    _breakers.clear()
+
+
+class _EndpointState:
+    def __init__(self, spec: EndpointSpec):
+        self.spec = spec
+        self.outstanding = 0
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return breaker_for(self.spec.url)
+
+    def has_capacity(self) -> bool:
+        if self.breaker.is_open:
+            return False
+        return not self.spec.max_inflight or self.outstanding < self.spec.max_inflight
+
+    def load(self) -> float:
+        # 按「再多一个请求后」的负载比较，空闲时高权重端点优先
+        return (self.outstanding + 1) / self.spec.weight
+
+
+class EndpointPool:
+    """最少在途请求的加权均衡，只在 tts_client 的事件循环线程内使用，不需要加锁"""
+
+    def __init__(self, endpoints: Tuple[EndpointSpec, ...]):
+        self._states = [_EndpointState(spec) for spec in endpoints]
+        self._waiters: List[asyncio.Future] = []
+
+    def _pick(self) -> Optional[_EndpointState]:
+        candidates = [state for state in self._states if state.has_capacity()]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda state: (state.load(), -state.spec.weight))
+
+    def _raise_if_all_down(self):
+        if all(state.breaker.is_open for state in self._states):
+            details = "; ".join(f"{state.spec.url} ({state.breaker.last_error})" for state in self._states)
+            raise EndpointsUnavailable(f"All TTS endpoints are down: {details}")
+
+    def _wake_next(self):
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[str]:
+        """占用一个端点直到退出，返回端点地址；可用端点都满时排队等待，全部熔断时抛 EndpointsUnavailable"""
+        state = self._pick()
+        while state is None:
+            self._raise_if_all_down()
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 已被唤醒却取消了，把名额让给下一个等待者
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+                raise
+            state = self._pick()
+        state.outstanding += 1
+        state.breaker.last_used = time.monotonic()
+        try:
+            yield state.spec.url
+        finally:
+            state.outstanding -= 1
+            self._wake_next()
+
+    def stats(self) -> List[Dict]:
+        return [
+            {
+                "url": state.spec.url,
+                "weight": state.spec.weight,
+                "max_inflight": state.spec.max_inflight,
+                "outstanding": state.outstanding,
+                "down": state.breaker.is_open,
+            }
+            for state in self._states
+        ]
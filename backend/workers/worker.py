@@ -1,54 +1,281 @@
+import datetime
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
-from database import SessionLocal, Task, Project
+from database import SessionLocal, Task, Project, Config
 from .analyze_characters import analyze_characters_handler
 # from parse_script import parse_script_handler
 from .synthesis_voicedesign import synthesis_voicedesign_handler
+from .synthesis_script import synthesis_script_handler
+from .cancellation import TaskCancelled, clear_cancel_state
+from .errors import is_retryable
+from .events import publish_task
+from .task_queue import (
+    LEASE_SECONDS,
+    PRIORITY_INTERACTIVE,
+    WORKER_ID,
+    claim_task,
+    fail_project_state,
+    max_attempts_for,
+    not_cancel_requested,
+    notify_worker,
+    reap_expired_tasks,
+    renew_leases,
+    restore_project_state,
+    retry_delay,
+    settle_synthesis_state,
+    wait_for_work,
+)
 
 
 HANDLERS = {
     "analyze_char": analyze_characters_handler,
     # "parse_script": parse_script_handler,
     "synthesis_voicedesign": synthesis_voicedesign_handler,
+    "synthesis_script": synthesis_script_handler,
 }
 
+# 正常情况下由 notify_worker 唤醒，轮询只用于兜底（如其他进程写入的任务）
+FALLBACK_POLL_INTERVAL = 5
+DEFAULT_MAX_WORKERS = 2
+# syn.max_workers 的硬上限，线程按需创建，超出部分不会生效
+MAX_POOL_THREADS = 32
+# 续租间隔取租约的 1/3，单次心跳失败也不会让租约过期
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 3
+
+# 池大小 > 1 时为交互通道（角色试听）预留的空位，批量任务不能占满整个池
+RESERVED_INTERACTIVE_SLOTS = 1
+
+# 按任务类型限制并发，未列出的类型只受池大小约束
+TASK_TYPE_LIMITS = {
+    "analyze_char": 1,
+}
+
+_executor = ThreadPoolExecutor(max_workers=MAX_POOL_THREADS, thread_name_prefix="task-worker")
+_running: dict[str, str] = {}  # task_id -> task_type
+_running_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def get_max_workers(db: Session) -> int:
+    """读取 syn.max_workers，每轮调度都重新读取，修改设置后无需重启"""
+    item = db.query(Config).filter(Config.key == "syn.max_workers").first()
+    try:
+        value = int(float(item.value)) if item and item.value else DEFAULT_MAX_WORKERS
+    except (TypeError, ValueError):
+        value = DEFAULT_MAX_WORKERS
+    return min(max(value, 1), MAX_POOL_THREADS)
+
+
+def _saturated_types() -> list[str]:
+    counts: dict[str, int] = {}
+    for task_type in _running.values():
+        counts[task_type] = counts.get(task_type, 0) + 1
+    return [
+        task_type
+        for task_type, limit in TASK_TYPE_LIMITS.items()
+        if counts.get(task_type, 0) >= limit
+    ]
+
+
+def _settle(db: Session, task: Task, values: dict, note: str, *criteria) -> bool:
+    """
+    以「仍由本 Worker 持有」为条件写入任务状态（与 renew_leases 一样的条件 UPDATE），criteria 为附加条件。
+    租约在执行期间被回收并改派时，以新的持有者为准：回滚本次改动并返回 False。
+    """
+    updated = (
+        db.query(Task)
+        .filter(Task.id == task.id, Task.worker_id == WORKER_ID, Task.status == "processing", *criteria)
+        .update(values, synchronize_session=False)
+    )
+    if updated != 1:
+        db.rollback()
+        print(f"Task {task.id} lease lost, discarding {note}")
+        return False
+    db.expire(task)
+    return True
+
+
+def _settle_cancelled(db: Session, task: Task):
+    settled = _settle(
+        db,
+        task,
+        {
+            Task.status: "cancelled",
+            Task.error_msg: "Cancelled by user",
+            Task.lease_expires_at: None,
+            Task.finished_at: datetime.datetime.now(),
+        },
+        "cancellation",
+    )
+    if not settled:
+        return
+    restore_project_state(db, task)
+    db.commit()
+    publish_task(task)
+
+
 def process_task(task: Task, db: Session):
     try:
         handler = HANDLERS[task.type]
         result = handler(task, db)
-        
-        task.status = "success"
-        task.result = result 
+
+        settled = _settle(
+            db,
+            task,
+            {
+                Task.status: "success",
+                Task.result: result,
+                Task.error_msg: None,
+                Task.lease_expires_at: None,
+                Task.finished_at: datetime.datetime.now(),
+            },
+            "result",
+        )
+        if not settled:
+            return
         if task.type == "analyze_char":
             project = db.query(Project).filter(Project.id == task.project_id).first()
             if project:
                 project.state = "characters_ready"
+        elif task.type == "synthesis_script":
+            settle_synthesis_state(db, task)
 
         db.commit()
+        publish_task(task)
+    except TaskCancelled:
+        db.rollback()
+        _settle_cancelled(db, task)
     except Exception as e:
-        task.status = "failed"
-        task.error_msg = str(e)
-        project = db.query(Project).filter(Project.id == task.project_id).first()
-        if project:
-            project.state = "failed"
+        db.rollback()
+        retryable = is_retryable(e)
+        attempts = int(task.attempts or 0)
+        values = {Task.error_msg: str(e), Task.lease_expires_at: None}
+        if retryable and task.cancel_requested:
+            # 已请求取消的任务不再重新排队
+            _settle_cancelled(db, task)
+            return
+        if retryable and attempts < max_attempts_for(task.type):
+            # 暂时性失败：退避后重新排队，项目状态保持不变
+            delay = retry_delay(attempts)
+            values.update({
+                Task.status: "pending",
+                Task.worker_id: None,
+                Task.next_attempt_at: datetime.datetime.now() + datetime.timedelta(seconds=delay),
+            })
+            # 读到标记之后才取消的，留给租约回收按 cancel_requested 结束
+            if not _settle(db, task, values, "failure", not_cancel_requested()):
+                return
+            print(f"Task {task.id} attempt {attempts} failed, retrying in {delay:.1f}s: {e}")
+        else:
+            # 重试次数用尽的暂时性失败进入死信，其余错误直接判失败
+            values.update({
+                Task.status: "dead_letter" if retryable else "failed",
+                Task.finished_at: datetime.datetime.now(),
+            })
+            if not _settle(db, task, values, "failure"):
+                return
+            fail_project_state(db, task)
         db.commit()
+        publish_task(task)
 
-def worker_loop():
-    while True:
+
+def _run_task(task_id: str):
+    db = SessionLocal()
+    try:
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if task:
+            process_task(task, db)
+    except Exception as e:
+        print(f"Worker error on task {task_id}: {e}")
+    finally:
+        db.close()
+        with _running_lock:
+            _running.pop(task_id, None)
+        clear_cancel_state(task_id)
+        notify_worker()
+
+
+def _claim_next_task(db: Session) -> Task | None:
+    """池有空位时原子领取一个可执行的 pending 任务"""
+    max_workers = get_max_workers(db)
+    with _running_lock:
+        running_count = len(_running)
+        if running_count >= max_workers:
+            return None
+        blocked_types = _saturated_types()
+
+    max_priority = None
+    if max_workers > 1 and running_count >= max_workers - RESERVED_INTERACTIVE_SLOTS:
+        max_priority = PRIORITY_INTERACTIVE
+    task = claim_task(db, exclude_types=blocked_types, max_priority=max_priority)
+    if not task:
+        return None
+
+    with _running_lock:
+        _running[task.id] = task.type
+    publish_task(task)
+    return task
+
+
+def worker_loop(poll_interval: float = FALLBACK_POLL_INTERVAL):
+    while not _stopping.is_set():
+        claimed = None
         db = SessionLocal()
         try:
-            task = db.query(Task).filter(Task.status == "pending").order_by(Task.created_at).first()
-            if task:
-                task.status = "processing"
-                db.commit()
-                process_task(task, db)
+            claimed = _claim_next_task(db)
+            if claimed:
+                _executor.submit(_run_task, claimed.id)
         except Exception as e:
             print(f"Worker error: {e}")
         finally:
             db.close()
-        time.sleep(2)  
-        
-def start_worker():
-    thread = threading.Thread(target=worker_loop, daemon=True)
+        # 队列有活时连续派发，直到池满或队列取空才进入等待
+        if not claimed:
+            wait_for_work(poll_interval)
+
+
+def lease_loop():
+    """定期为执行中的任务续租，并回收其他（已崩溃）Worker 遗留的过期任务"""
+    while True:
+        db = SessionLocal()
+        try:
+            with _running_lock:
+                running_ids = list(_running.keys())
+            if running_ids:
+                for task_id in renew_leases(db, running_ids):
+                    print(f"Worker lost lease on task {task_id}")
+            if reap_expired_tasks(db):
+                notify_worker()
+        except Exception as e:
+            print(f"Lease maintenance error: {e}")
+        finally:
+            db.close()
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def start_worker(poll_interval: float = FALLBACK_POLL_INTERVAL):
+    """
+    启动调度与续租线程。poll_interval 是没有唤醒信号时回查数据库的间隔，
+    独立 Worker 进程收不到 API 进程的 notify_worker，需要设得更短
+    """
+    _stopping.clear()
+    thread = threading.Thread(target=worker_loop, args=(poll_interval,), name="task-dispatcher", daemon=True)
     thread.start()
+    lease_thread = threading.Thread(target=lease_loop, name="task-lease", daemon=True)
+    lease_thread.start()
+
+
+def stop_worker(timeout: float = 30) -> int:
+    """停止领取新任务，最多等待 timeout 秒让执行中的任务收尾，返回仍未结束的任务数（由租约回收兜底）"""
+    _stopping.set()
+    notify_worker()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with _running_lock:
+            if not _running:
+                return 0
+        time.sleep(0.2)
+    with _running_lock:
+        return len(_running)
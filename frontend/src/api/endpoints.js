@@ -118,6 +118,19 @@ export const getTaskStatus = async (taskId) => {
   return client.get(`/tasks/${taskId}`);
 };
 
+// 批量查询任务状态（一次请求查多个任务）
+export const getTasksStatus = async (taskIds) => {
+  return client.post('/tasks/status', { task_ids: taskIds });
+};
+
+// 取消任务（排队中立即取消，执行中的在下一个检查点退出）
+export const cancelTask = async (taskId) => {
+  return client.post(`/tasks/${taskId}/cancel`);
+};
+
+// 任务状态推送 (SSE)，供 EventSource 直接订阅
+export const getTaskEventsUrl = (taskId) => `${client.defaults.baseURL}/tasks/${taskId}/events`;
+
 // ==========================================
 // 5. 音频资产库 (CharacterRef / Effect / BGM)
 // ==========================================
@@ -141,6 +141,7 @@ export default function SettingsModal({ open, close }) {
     if (item.key.startsWith('tts.local.')) return activeTTS === 'local_pytorch';
     if (item.key.startsWith('tts.vllm.')) return activeTTS === 'local_vllm';
     if (item.key.startsWith('tts.autodl.')) return activeTTS === 'autodl';
+    if (item.key.startsWith('tts.qwen_api.')) return activeTTS === 'qwen_api';
     if (item.key.startsWith('tts.aliyun.')) return activeTTS === 'aliyun';
 
     return true;
@@ -407,6 +408,14 @@ export default function SettingsModal({ open, close }) {
           : 'For local/LAN deployment. Must provide /v1/audio/speech.',
         tag: isZh ? '兼容' : 'Compat',
       },
+      {
+        id: 'qwen_api',
+        title: isZh ? 'Qwen REST 服务' : 'Qwen REST Services',
+        desc: isZh
+          ? '使用 models_deploy 中的 qwen-voice-design / qwen-voice-clone 服务。'
+          : 'Use the qwen-voice-design / qwen-voice-clone services from models_deploy.',
+        tag: 'REST',
+      },
       {
         id: 'autodl',
         title: 'AutoDL',
@@ -459,6 +468,14 @@ export default function SettingsModal({ open, close }) {
         labelSecondary: isZh ? 'Base 端口' : 'Base Port',
       };
     }
+    if (ttsBackend === 'qwen_api') {
+      return {
+        primary: cfg['tts.qwen_api.vd_url'] || 'http://localhost:8001',
+        secondary: cfg['tts.qwen_api.clone_url'] || 'http://localhost:8002',
+        labelPrimary: isZh ? 'VoiceDesign 服务' : 'VoiceDesign Service',
+        labelSecondary: isZh ? 'VoiceClone 服务' : 'VoiceClone Service',
+      };
+    }
     if (ttsBackend === 'aliyun') {
       return {
         primary: cfg['tts.aliyun.region'] || 'beijing',
@@ -506,6 +523,9 @@ export default function SettingsModal({ open, close }) {
     'tts.vllm.vd_url',
     'tts.autodl.base_port',
     'tts.autodl.vd_port',
+    'tts.qwen_api.vd_url',
+    'tts.qwen_api.clone_url',
+    'tts.qwen_api.batch_lines',
     'tts.aliyun.api_key',
     'tts.aliyun.region',
   ]), []);
@@ -1282,13 +1302,16 @@ export default function SettingsModal({ open, close }) {
                           <div className="text-xs font-semibold uppercase tracking-wide text-slate-500 dark:text-[#9a9a9a]">
                             {isZh ? '核心配置' : 'Core Configuration'}
                           </div>
-                          {(ttsBackend === 'local_vllm' || ttsBackend === 'autodl') && (
+                          {(ttsBackend === 'local_vllm' || ttsBackend === 'autodl' || ttsBackend === 'qwen_api') && (
                             <button
                               type="button"
                               onClick={() => {
                                 if (ttsBackend === 'local_vllm') {
                                   updateField('tts.vllm.base_url', 'http://localhost:6008');
                                   updateField('tts.vllm.vd_url', 'http://localhost:6006');
+                                } else if (ttsBackend === 'qwen_api') {
+                                  updateField('tts.qwen_api.vd_url', 'http://localhost:8001');
+                                  updateField('tts.qwen_api.clone_url', 'http://localhost:8002');
                                 } else {
                                   updateField('tts.autodl.base_port', '6008');
                                   updateField('tts.autodl.vd_port', '6006');
@@ -1345,6 +1368,23 @@ export default function SettingsModal({ open, close }) {
                             </>
                           )}
 
+                          {ttsBackend === 'qwen_api' && (
+                            <>
+                              {renderTtsRow(
+                                getTtsItem('tts.qwen_api.vd_url', { type: 'text', label: isZh ? 'VoiceDesign 服务地址' : 'VoiceDesign URL' }),
+                                isZh ? 'qwen-voice-design 服务，用于角色音色设计预览。示例：http://localhost:8001' : 'qwen-voice-design service for voice preview. Example: http://localhost:8001'
+                              )}
+                              {renderTtsRow(
+                                getTtsItem('tts.qwen_api.clone_url', { type: 'text', label: isZh ? 'VoiceClone 服务地址' : 'VoiceClone URL' }),
+                                isZh ? 'qwen-voice-clone 服务，用于台词合成。示例：http://localhost:8002' : 'qwen-voice-clone service for line synthesis. Example: http://localhost:8002'
+                              )}
+                              {renderTtsRow(
+                                getTtsItem('tts.qwen_api.batch_lines', { type: 'number', label: isZh ? '批量请求台词数' : 'Lines per batch request' }),
+                                isZh ? '合成台词时每个 /v1/voice-clone/batch 请求包含的句数，1 为逐句请求。示例：8' : 'Lines sent per /v1/voice-clone/batch request during synthesis; 1 sends one line per request. Example: 8'
+                              )}
+                            </>
+                          )}
+
                           {ttsBackend === 'aliyun' && (
                             <>
                               {renderTtsRow(
@@ -1,28 +1,44 @@
 import { useState, useRef, useEffect } from 'react';
-import { getTaskStatus } from '../api/endpoints'; // 假设你定义了这个API
+import { getTaskStatus, getTaskEventsUrl } from '../api/endpoints';
 
 export function useTaskPoller() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const pollTimer = useRef(null);
+  const eventSource = useRef(null);
+
+  const closeStream = () => {
+    if (eventSource.current) {
+      eventSource.current.close();
+      eventSource.current = null;
+    }
+  };
 
   const startPolling = async (taskId, onSuccess) => {
     clearTimeout(pollTimer.current);
+    closeStream();
     setLoading(true);
     setError(null);
 
+    // 返回 true 表示任务已结束
+    const handleStatus = ({ status, result, error_msg: taskError } = {}) => {
+      if (status === 'success') {
+        setLoading(false);
+        onSuccess(result); // 任务完成，回调数据
+        return true;
+      }
+      if (status === 'failed' || status === 'cancelled' || status === 'dead_letter') {
+        setLoading(false);
+        setError(taskError || (status === 'cancelled' ? 'Task cancelled' : 'Task failed'));
+        return true;
+      }
+      return false;
+    };
+
     const checkStatus = async () => {
       try {
         const res = await getTaskStatus(taskId); // 调用 GET /api/tasks/{id}
-        const { status, result, error_msg: taskError } = res || {};
-
-        if (status === 'success') {
-          setLoading(false);
-          onSuccess(result); // 任务完成，回调数据
-        } else if (status === 'failed') {
-          setLoading(false);
-          setError(taskError || 'Task failed');
-        } else {
+        if (!handleStatus(res || {})) {
           // pending 或 processing，继续轮询
           pollTimer.current = setTimeout(checkStatus, 2000); // 2秒查一次
         }
@@ -32,12 +48,33 @@ export function useTaskPoller() {
       }
     };
 
-    checkStatus();
+    // 优先用 SSE 接收状态推送，浏览器不支持或连接出错时退回轮询
+    if (typeof EventSource === 'undefined') {
+      checkStatus();
+      return;
+    }
+    const source = new EventSource(getTaskEventsUrl(taskId));
+    eventSource.current = source;
+    source.addEventListener('task', (evt) => {
+      try {
+        if (handleStatus(JSON.parse(evt.data))) closeStream();
+      } catch (err) {
+        console.error('Invalid task event:', err);
+      }
+    });
+    source.onerror = () => {
+      if (eventSource.current !== source) return;
+      closeStream();
+      checkStatus();
+    };
   };
 
-  // 组件卸载时清理定时器
+  // 组件卸载时清理定时器和 SSE 连接
   useEffect(() => {
-    return () => clearTimeout(pollTimer.current);
+    return () => {
+      clearTimeout(pollTimer.current);
+      closeStream();
+    };
   }, []);
 
   return { startPolling, loading, error };
@@ -247,15 +247,22 @@ export default function Studio() {
       }
 
       setLines((prev) => prev.map((line) => (ids.includes(line.id) ? { ...line, status: 'processing' } : line)));
-      const resp = await API.synthesize({ project_id: pid, line_ids: ids });
-      const taskId = resp?.task_id || resp?.data?.task_id;
-      if (taskId) {
-        startPolling(taskId, async () => {
-          await refreshData(true);
-          setSynthLineId('');
-          setSynthAllLoading(false);
-          setNotice(singleId ? (isZh ? '该条合成完成。' : 'Line synthesized.') : (isZh ? '全部待处理已合成。' : 'All pending synthesized.'));
-        });
+      const resp = await API.synthesize({ project_id: pid, line_ids: ids, focus_line_id: activeLineId || undefined });
+      const body = resp?.data || resp;
+      const taskId = body?.task_id;
+      // 已在排队的行不会重复入队，同样等这些已有任务结束
+      const queuedIds = (body?.queued_tasks || []).map((task) => task.task_id);
+      const onDone = async () => {
+        await refreshData(true);
+        setSynthLineId('');
+        setSynthAllLoading(false);
+        setNotice(singleId ? (isZh ? '该条合成完成。' : 'Line synthesized.') : (isZh ? '全部待处理已合成。' : 'All pending synthesized.'));
+      };
+      if (taskId && queuedIds.length === 0) {
+        startPolling(taskId, onDone);
+      } else if (taskId || queuedIds.length > 0) {
+        await waitForTasks([taskId, ...queuedIds].filter(Boolean));
+        await onDone();
       } else {
         await refreshData(true);
         setSynthLineId('');
@@ -285,10 +292,31 @@ export default function Studio() {
     void synthesizeLines(pendingIds);
   };
 
+  // 等待一组任务全部结束（重新合成过期台词时按角色拆成多个任务）
+  const waitForTasks = async (taskIds) => {
+    let active = taskIds;
+    while (active.length > 0) {
+      // eslint-disable-next-line no-await-in-loop
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      // eslint-disable-next-line no-await-in-loop
+      const res = await API.getTasksStatus(active);
+      const rows = Array.isArray(res) ? res : (res?.data || []);
+      active = rows
+        .filter((task) => task.status === 'pending' || task.status === 'processing')
+        .map((task) => task.id);
+    }
+  };
+
   const handleResolveStaleAudio = async (action) => {
     setStaleResolvingAction(action);
     try {
-      await API.resolveStaleAudio(pid, { action });
+      const resp = await API.resolveStaleAudio(pid, { action });
+      const body = resp?.data || resp;
+      // 已在排队的行不会重复入队，同样等这些已有任务结束
+      const queuedTasks = [...(body?.tasks || []), ...(body?.queued_tasks || [])];
+      if (queuedTasks.length > 0) {
+        await waitForTasks(queuedTasks.map((task) => task.task_id));
+      }
       await refreshData(true);
       const latest = await API.getProjectPipelineStatus(pid);
       const latestPipeline = latest?.data || latest;
@@ -2,20 +2,56 @@ from __future__ import annotations
 
 import base64
 import io
+import json
+import struct
+from typing import Iterable, Iterator
 
 import numpy as np
 import soundfile as sf
 
+# response_format -> (soundfile 格式, MIME)；WAV 为 16-bit PCM
+AUDIO_FORMATS = {
+    "wav": ("WAV", "audio/wav"),
+    "flac": ("FLAC", "audio/flac"),
+}
+# 批量接口的二进制响应：若干帧，每帧 = 4 字节小端头长度 + UTF-8 JSON 头（含 size）+ size 字节音频
+FRAMES_MEDIA_TYPE = "application/x-audio-frames"
 
-def wav_to_bytes(wav: np.ndarray, sample_rate: int) -> bytes:
+
+def wav_to_bytes(wav: np.ndarray, sample_rate: int, audio_format: str = "wav") -> bytes:
     audio = np.asarray(wav, dtype=np.float32)
     if audio.ndim > 1:
         audio = np.squeeze(audio)
 
+    sf_format, _ = AUDIO_FORMATS[audio_format]
     with io.BytesIO() as buffer:
-        sf.write(buffer, audio, sample_rate, format="WAV")
+        sf.write(buffer, audio, sample_rate, format=sf_format, subtype="PCM_16")
         return buffer.getvalue()
 
 
 def wav_bytes_to_base64(audio_bytes: bytes) -> str:
     return base64.b64encode(audio_bytes).decode("ascii")
+
+
+def media_type_for(audio_format: str) -> str:
+    return AUDIO_FORMATS[audio_format][1]
+
+
+def pack_frame(meta: dict[str, object], payload: bytes = b"") -> bytes:
+    header = json.dumps({**meta, "size": len(payload)}, ensure_ascii=False).encode("utf-8")
+    return struct.pack("<I", len(header)) + header + payload
+
+
+def audio_frames(
+    outcomes: Iterable[tuple[int, tuple[np.ndarray, int] | None, str | None]], audio_format: str
+) -> Iterator[bytes]:
+    """把 (index, (wav, sr) | None, error | None) 逐条编码成二进制帧，生成一条发一条"""
+    mime_type = media_type_for(audio_format)
+    for index, result, error in outcomes:
+        if result is None:
+            yield pack_frame({"index": index, "error": error})
+            continue
+        wav, sr = result
+        yield pack_frame(
+            {"index": index, "sample_rate": sr, "mime_type": mime_type}, wav_to_bytes(wav, sr, audio_format)
+        )
@@ -1,16 +1,31 @@
 from __future__ import annotations
 
+import base64
+import hashlib
+import logging
 import os
 import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from pathlib import Path
 from typing import Literal
 
+import numpy as np
 import torch
 from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, model_validator
 from qwen_tts import Qwen3TTSModel
 
-from services.audio_utils import wav_bytes_to_base64, wav_to_bytes
+from services.audio_utils import (
+    FRAMES_MEDIA_TYPE,
+    audio_frames,
+    media_type_for,
+    wav_bytes_to_base64,
+    wav_to_bytes,
+)
+from services.batching import MicroBatcher, estimate_tokens, iter_outcomes, length_bucket
+from services.streaming import split_text_chunks, stream_audio
 
 
 def _parse_bool(value: str | None, default: bool = False) -> bool:
@@ -30,16 +45,38 @@ def _parse_dtype(value: str) -> torch.dtype:
     raise ValueError(f"Unsupported QWEN_DTYPE: {value}")
 
 
-class VoiceCloneRequest(BaseModel):
-    text: str = Field(..., min_length=1)
-    language: str = "Auto"
-
+class RefVoiceFields(BaseModel):
     ref_text: str | None = None
     ref_audio_base64: str | None = None
     ref_audio_url: str | None = None
     ref_audio_path: str | None = None
 
     x_vector_only_mode: bool = False
+
+    def has_ref_audio(self) -> bool:
+        return any([self.ref_audio_base64, self.ref_audio_url, self.ref_audio_path])
+
+    def check_ref_voice(self) -> None:
+        if not self.has_ref_audio():
+            raise ValueError("One of ref_audio_base64 / ref_audio_url / ref_audio_path is required")
+
+        if not self.x_vector_only_mode and not self.ref_text:
+            raise ValueError("ref_text is required when x_vector_only_mode is false")
+
+
+class VoiceRegisterRequest(RefVoiceFields):
+    @model_validator(mode="after")
+    def validate_inputs(self) -> "VoiceRegisterRequest":
+        self.check_ref_voice()
+        return self
+
+
+class VoiceRegisterResponse(BaseModel):
+    voice_id: str
+    cached: bool
+
+
+class GenerationParams(BaseModel):
     non_streaming_mode: bool = False
 
     do_sample: bool | None = None
@@ -53,20 +90,57 @@ class VoiceCloneRequest(BaseModel):
     subtalker_temperature: float | None = None
     max_new_tokens: int | None = None
 
-    response_format: Literal["base64", "wav"] = "base64"
+    def gen_kwargs(self) -> dict[str, object]:
+        gen_kwargs = {
+            "do_sample": self.do_sample,
+            "top_k": self.top_k,
+            "top_p": self.top_p,
+            "temperature": self.temperature,
+            "repetition_penalty": self.repetition_penalty,
+            "subtalker_dosample": self.subtalker_dosample,
+            "subtalker_top_k": self.subtalker_top_k,
+            "subtalker_top_p": self.subtalker_top_p,
+            "subtalker_temperature": self.subtalker_temperature,
+            "max_new_tokens": self.max_new_tokens,
+        }
+        return {k: v for k, v in gen_kwargs.items() if v is not None}
+
+    def batch_key(self) -> tuple:
+        """采样参数相同的请求才能放进同一次 generate"""
+        return (self.non_streaming_mode, tuple(sorted(self.gen_kwargs().items())))
+
+
+class VoiceCloneItem(RefVoiceFields):
+    text: str = Field(..., min_length=1)
+    language: str = "Auto"
+
+    # 通过 /v1/voices 预先注册得到的音色 id，给出时忽略 ref_* 字段
+    voice_id: str | None = None
 
     @model_validator(mode="after")
-    def validate_inputs(self) -> "VoiceCloneRequest":
-        has_ref_audio = any(
-            [self.ref_audio_base64, self.ref_audio_url, self.ref_audio_path]
-        )
-        if not has_ref_audio:
-            raise ValueError("One of ref_audio_base64 / ref_audio_url / ref_audio_path is required")
+    def validate_inputs(self) -> "VoiceCloneItem":
+        if not self.voice_id:
+            self.check_ref_voice()
+        return self
 
-        if not self.x_vector_only_mode and not self.ref_text:
-            raise ValueError("ref_text is required when x_vector_only_mode is false")
 
-        return self
+class VoiceCloneRequest(VoiceCloneItem, GenerationParams):
+    # 默认直接返回音频二进制；base64 为兼容旧调用方保留，体积多 1/3
+    response_format: Literal["wav", "flac", "base64"] = "wav"
+
+
+class VoiceCloneStreamRequest(VoiceCloneItem, GenerationParams):
+    # wav：长度未知的 WAV 头 + 16-bit PCM；pcm：只有 16-bit PCM，采样率见 X-Sample-Rate 响应头
+    format: Literal["wav", "pcm"] = "wav"
+
+
+class VoiceCloneBatchRequest(GenerationParams):
+    # 采样参数对整批生效；每条可以用不同的参考音 / voice_id
+    items: list[VoiceCloneItem] = Field(..., min_length=1)
+    # 本批内的临时音色：多条共用同一参考音时只传一次，条目的 voice_id 优先在这里查找
+    voices: dict[str, VoiceRegisterRequest] = Field(default_factory=dict)
+    # wav / flac：按条流式返回二进制帧（见 audio_utils.pack_frame）；base64：整批 JSON
+    response_format: Literal["wav", "flac", "base64"] = "wav"
 
 
 class AudioResponse(BaseModel):
@@ -75,17 +149,48 @@ class AudioResponse(BaseModel):
     mime_type: str = "audio/wav"
 
 
+class BatchItemResult(BaseModel):
+    index: int
+    sample_rate: int | None = None
+    audio_base64: str | None = None
+    mime_type: str = "audio/wav"
+    error: str | None = None
+
+
+class BatchResponse(BaseModel):
+    items: list[BatchItemResult]
+
+
 MODEL_NAME = os.getenv("QWEN_VOICE_CLONE_MODEL", "Qwen/Qwen3-TTS-12Hz-1.7B-Base")
 DEVICE = os.getenv("QWEN_DEVICE", "cuda:0" if torch.cuda.is_available() else "cpu")
 DEFAULT_DTYPE = "float32" if DEVICE.startswith("cpu") else "bfloat16"
 DTYPE = _parse_dtype(os.getenv("QWEN_DTYPE", DEFAULT_DTYPE))
 ATTN_IMPLEMENTATION = os.getenv("QWEN_ATTN_IMPLEMENTATION", "").strip()
 MODEL_LOCAL_FILES_ONLY = _parse_bool(os.getenv("QWEN_MODEL_LOCAL_FILES_ONLY"), default=False)
+# 参考音 -> speaker prompt 的 LRU 缓存条数，0 表示不缓存（每次请求都重新编码参考音）
+PROMPT_CACHE_SIZE = max(int(os.getenv("QWEN_PROMPT_CACHE_SIZE", "64")), 0)
+# 一次 generate 的最大条数（微批调度与批量接口共用）
+MAX_BATCH_SIZE = max(int(os.getenv("QWEN_MAX_BATCH_SIZE", "16")), 1)
+# 微批窗口：第一条请求到达后最多等这么久再开跑，期间到达的请求合成一批
+BATCH_WINDOW_MS = max(float(os.getenv("QWEN_BATCH_WINDOW_MS", "20")), 0.0)
+# 一批的估算 codec token 上限，0 表示只按条数限制
+BATCH_MAX_TOKENS = max(int(os.getenv("QWEN_BATCH_MAX_TOKENS", "4096")), 0)
+# 流式接口的分段长度（字符）：第一段尽量短以便尽快出声，后续段合并到这个长度左右
+STREAM_FIRST_CHUNK_CHARS = max(int(os.getenv("QWEN_STREAM_FIRST_CHUNK_CHARS", "24")), 1)
+STREAM_CHUNK_CHARS = max(int(os.getenv("QWEN_STREAM_CHUNK_CHARS", "80")), 1)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Qwen3-TTS VoiceClone API", version="1.0.0")
 _model_lock = threading.Lock()
 _model: Qwen3TTSModel | None = None
 
+# voice_id -> create_voice_clone_prompt 的结果。同一角色的每句台词都带同一段参考音，
+# 缓存后只在第一次解码、重采样、编码参考音。/v1/voices 注册的音色单独保存，不参与淘汰。
+_cache_lock = threading.Lock()
+_prompt_cache: OrderedDict[str, object] = OrderedDict()
+_registered_voices: dict[str, object] = {}
+
 
 @app.on_event("startup")
 def _startup() -> None:
@@ -103,30 +208,157 @@ def _startup() -> None:
 
 
 @app.get("/v1/health")
-def health() -> dict[str, str]:
+def health() -> dict[str, object]:
+    with _cache_lock:
+        cached, registered = len(_prompt_cache), len(_registered_voices)
     return {
         "status": "ok",
         "service": "qwen-voice-clone",
         "model": MODEL_NAME,
         "device": DEVICE,
+        "prompt_cache": {"size": cached, "capacity": PROMPT_CACHE_SIZE, "registered": registered},
     }
 
 
-def _pick_ref_audio(request: VoiceCloneRequest) -> str:
+def _pick_ref_audio(request: RefVoiceFields) -> tuple[str, bytes]:
+    """返回 (传给模型的参考音, 用于计算缓存键的内容)"""
     if request.ref_audio_base64:
         b64 = request.ref_audio_base64.strip()
-        if b64.startswith("data:audio"):
-            return b64
-        return f"data:audio/wav;base64,{b64}"
+        data_url = b64 if b64.startswith("data:audio") else f"data:audio/wav;base64,{b64}"
+        try:
+            content = base64.b64decode(data_url.split(",", 1)[1], validate=False)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid ref_audio_base64: {exc}") from exc
+        return data_url, content
 
     if request.ref_audio_url:
-        return request.ref_audio_url.strip()
+        # 不为算哈希预先下载，URL 本身作为缓存键；URL 指向的内容变了需换 URL
+        url = request.ref_audio_url.strip()
+        return url, url.encode("utf-8")
 
     assert request.ref_audio_path is not None
     ref_audio_path = Path(request.ref_audio_path).expanduser().resolve()
     if not ref_audio_path.exists():
         raise HTTPException(status_code=400, detail=f"ref_audio_path not found: {ref_audio_path}")
-    return str(ref_audio_path)
+    return str(ref_audio_path), ref_audio_path.read_bytes()
+
+
+def _voice_id(content: bytes, ref_text: str | None, x_vector_only_mode: bool) -> str:
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(content).digest())
+    digest.update(b"\0" + (ref_text or "").encode("utf-8"))
+    digest.update(b"\0x" if x_vector_only_mode else b"\0-")
+    return digest.hexdigest()[:32]
+
+
+def _lookup_prompt(voice_id: str) -> object | None:
+    with _cache_lock:
+        prompt = _registered_voices.get(voice_id)
+        if prompt is None:
+            prompt = _prompt_cache.get(voice_id)
+            if prompt is not None:
+                _prompt_cache.move_to_end(voice_id)
+        return prompt
+
+
+def _remember_prompt(voice_id: str, prompt: object) -> None:
+    if PROMPT_CACHE_SIZE <= 0:
+        return
+    with _cache_lock:
+        _prompt_cache[voice_id] = prompt
+        _prompt_cache.move_to_end(voice_id)
+        while len(_prompt_cache) > PROMPT_CACHE_SIZE:
+            _prompt_cache.popitem(last=False)
+
+
+def _get_voice_prompt(request: RefVoiceFields) -> tuple[str, object, bool]:
+    """返回 (voice_id, prompt, 是否命中缓存)，未命中时编码参考音并写入缓存"""
+    assert _model is not None
+    ref_audio, content = _pick_ref_audio(request)
+    voice_id = _voice_id(content, request.ref_text, request.x_vector_only_mode)
+    prompt = _lookup_prompt(voice_id)
+    if prompt is not None:
+        return voice_id, prompt, True
+
+    try:
+        with _model_lock:
+            prompt = _model.create_voice_clone_prompt(
+                ref_audio=ref_audio,
+                ref_text=request.ref_text,
+                x_vector_only_mode=request.x_vector_only_mode,
+            )
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid reference voice: {exc}") from exc
+    _remember_prompt(voice_id, prompt)
+    return voice_id, prompt, False
+
+
+@app.post("/v1/voices", response_model=VoiceRegisterResponse)
+def register_voice(request: VoiceRegisterRequest):
+    """预先注册参考音，之后的克隆请求只需带 voice_id。注册的音色保存在进程内存中，服务重启后需重新注册"""
+    if _model is None:
+        raise HTTPException(status_code=503, detail="Model not initialized yet")
+
+    voice_id, prompt, cached = _get_voice_prompt(request)
+    with _cache_lock:
+        cached = cached or voice_id in _registered_voices
+        _registered_voices[voice_id] = prompt
+        _prompt_cache.pop(voice_id, None)
+    return VoiceRegisterResponse(voice_id=voice_id, cached=cached)
+
+
+@app.delete("/v1/voices/{voice_id}")
+def delete_voice(voice_id: str) -> dict[str, str]:
+    with _cache_lock:
+        removed = _registered_voices.pop(voice_id, None) is not None
+        removed = _prompt_cache.pop(voice_id, None) is not None or removed
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Unknown voice_id: {voice_id}")
+    return {"voice_id": voice_id, "status": "deleted"}
+
+
+def _resolve_prompt(item: VoiceCloneItem, local_prompts: dict[str, object] | None = None) -> object:
+    if item.voice_id:
+        if local_prompts and item.voice_id in local_prompts:
+            return local_prompts[item.voice_id]
+        prompt = _lookup_prompt(item.voice_id)
+        if prompt is None:
+            raise HTTPException(status_code=404, detail=f"Unknown voice_id: {item.voice_id}")
+        return prompt
+    _, prompt, _ = _get_voice_prompt(item)
+    return prompt
+
+
+def _run_batch(key: tuple, entries: list[tuple[VoiceCloneItem, object]]) -> list[tuple[np.ndarray, int]]:
+    """微批调度线程里执行：一次 generate 合成多条，prompt 列表按条拼接，和 text 一一对应"""
+    assert _model is not None
+    (non_streaming_mode, gen_items), _bucket = key
+    with _model_lock:
+        wavs, sr = _model.generate_voice_clone(
+            text=[item.text for item, _ in entries],
+            language=[item.language for item, _ in entries],
+            voice_clone_prompt=[entry for _, prompt in entries for entry in prompt],
+            non_streaming_mode=non_streaming_mode,
+            **dict(gen_items),
+        )
+    return [(wav, sr) for wav in wavs]
+
+
+_batcher: MicroBatcher[tuple[VoiceCloneItem, object], tuple[np.ndarray, int]] = MicroBatcher(
+    _run_batch,
+    max_batch_size=MAX_BATCH_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+    max_tokens=BATCH_MAX_TOKENS,
+    name="voice-clone-batcher",
+)
+
+
+def _submit(entries: list[tuple[VoiceCloneItem, object]], params: GenerationParams) -> list[Future]:
+    submissions = []
+    for item, prompt in entries:
+        tokens = estimate_tokens(item.text, params.max_new_tokens)
+        submissions.append(((params.batch_key(), length_bucket(tokens)), (item, prompt), tokens))
+    return _batcher.submit_many(submissions)
 
 
 @app.post("/v1/voice-clone", response_model=AudioResponse)
@@ -134,38 +366,100 @@ def generate_voice_clone(request: VoiceCloneRequest):
     if _model is None:
         raise HTTPException(status_code=503, detail="Model not initialized yet")
 
-    ref_audio = _pick_ref_audio(request)
-
-    gen_kwargs = {
-        "do_sample": request.do_sample,
-        "top_k": request.top_k,
-        "top_p": request.top_p,
-        "temperature": request.temperature,
-        "repetition_penalty": request.repetition_penalty,
-        "subtalker_dosample": request.subtalker_dosample,
-        "subtalker_top_k": request.subtalker_top_k,
-        "subtalker_top_p": request.subtalker_top_p,
-        "subtalker_temperature": request.subtalker_temperature,
-        "max_new_tokens": request.max_new_tokens,
-    }
-    gen_kwargs = {k: v for k, v in gen_kwargs.items() if v is not None}
+    prompt = _resolve_prompt(request)
 
     try:
-        with _model_lock:
-            wavs, sr = _model.generate_voice_clone(
-                text=request.text,
-                language=request.language,
-                ref_audio=ref_audio,
-                ref_text=request.ref_text,
-                x_vector_only_mode=request.x_vector_only_mode,
-                non_streaming_mode=request.non_streaming_mode,
-                **gen_kwargs,
-            )
+        wav, sr = _submit([(request, prompt)], request)[0].result()
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Voice clone failed: {exc}") from exc
 
-    audio_bytes = wav_to_bytes(wavs[0], sr)
-    if request.response_format == "wav":
-        return Response(content=audio_bytes, media_type="audio/wav")
+    if request.response_format == "base64":
+        return AudioResponse(sample_rate=sr, audio_base64=wav_bytes_to_base64(wav_to_bytes(wav, sr)))
+
+    return Response(
+        content=wav_to_bytes(wav, sr, request.response_format),
+        media_type=media_type_for(request.response_format),
+        headers={"X-Sample-Rate": str(sr)},
+    )
+
+
+def _batch_response(slots: list[Future | str], response_format: str):
+    outcomes = iter_outcomes(slots, "Voice clone failed")
+    if response_format != "base64":
+        return StreamingResponse(audio_frames(outcomes, response_format), media_type=FRAMES_MEDIA_TYPE)
+
+    results = []
+    for index, result, error in outcomes:
+        if result is None:
+            results.append(BatchItemResult(index=index, error=error))
+            continue
+        wav, sr = result
+        results.append(
+            BatchItemResult(index=index, sample_rate=sr, audio_base64=wav_bytes_to_base64(wav_to_bytes(wav, sr)))
+        )
+    return BatchResponse(items=results)
+
+
+@app.post("/v1/voice-clone/batch", response_model=BatchResponse)
+def generate_voice_clone_batch(request: VoiceCloneBatchRequest):
+    """
+    一次请求合成多条，交给微批调度按 QWEN_MAX_BATCH_SIZE / token 预算分组送进模型，结果与 items 顺序一致。
+    单条的参考音错误只记在该条的 error 里；整组生成失败时逐条重试，定位到出错的条目。
+    默认按 items 顺序逐条返回二进制帧，生成完一条发一条，调用方可以边收边写盘。
+    """
+    if _model is None:
+        raise HTTPException(status_code=503, detail="Model not initialized yet")
+
+    local_prompts: dict[str, object] = {}
+    voice_errors: dict[str, str] = {}
+    for name, voice in request.voices.items():
+        try:
+            local_prompts[name] = _get_voice_prompt(voice)[1]
+        except HTTPException as exc:
+            voice_errors[name] = str(exc.detail)
+
+    # 每条一个 slot：投递后的 Future，或提交前就确定的错误信息
+    slots: list[Future | str] = [""] * len(request.items)
+    ready: list[tuple[int, VoiceCloneItem, object]] = []
+    for index, item in enumerate(request.items):
+        if item.voice_id in voice_errors:
+            slots[index] = voice_errors[item.voice_id]
+            continue
+        try:
+            ready.append((index, item, _resolve_prompt(item, local_prompts)))
+        except HTTPException as exc:
+            slots[index] = str(exc.detail)
+
+    futures = _submit([(item, prompt) for _, item, prompt in ready], request)
+    for (index, _, _), future in zip(ready, futures):
+        slots[index] = future
+
+    return _batch_response(slots, request.response_format)
+
+
+@app.post("/v1/voice-clone/stream")
+def stream_voice_clone(request: VoiceCloneStreamRequest):
+    """分句流式合成：第一段生成完就开始返回音频，后续段批量生成后按顺序追加"""
+    if _model is None:
+        raise HTTPException(status_code=503, detail="Model not initialized yet")
 
-    return AudioResponse(sample_rate=sr, audio_base64=wav_bytes_to_base64(audio_bytes))
+    prompt = _resolve_prompt(request)
+    texts = split_text_chunks(request.text, STREAM_FIRST_CHUNK_CHARS, STREAM_CHUNK_CHARS)
+    chunks = [request.model_copy(update={"text": text}) for text in texts]
+
+    # 第一段单独生成，失败时还能返回错误状态码；生成完再投递剩余段，保证第一段不和长段合批
+    try:
+        first = _submit([(chunks[0], prompt)], request)[0].result()
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Voice clone failed: {exc}") from exc
+    rest = _submit([(chunk, prompt) for chunk in chunks[1:]], request)
+
+    sr = first[1]
+    media_type = "audio/wav" if request.format == "wav" else f"audio/L16; rate={sr}; channels=1"
+    return StreamingResponse(
+        stream_audio(
+            first, rest, request.format, lambda exc: logger.error("Voice clone failed mid-stream: %s", exc)
+        ),
+        media_type=media_type,
+        headers={"X-Sample-Rate": str(sr), "X-Chunk-Count": str(len(chunks))},
+    )
@@ -2,14 +2,24 @@ from __future__ import annotations
 
 import os
 import threading
+from concurrent.futures import Future
 from typing import Literal
 
+import numpy as np
 import torch
 from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from qwen_tts import Qwen3TTSModel
 
-from services.audio_utils import wav_bytes_to_base64, wav_to_bytes
+from services.audio_utils import (
+    FRAMES_MEDIA_TYPE,
+    audio_frames,
+    media_type_for,
+    wav_bytes_to_base64,
+    wav_to_bytes,
+)
+from services.batching import MicroBatcher, estimate_tokens, iter_outcomes, length_bucket
 
 
 def _parse_bool(value: str | None, default: bool = False) -> bool:
@@ -29,10 +39,7 @@ def _parse_dtype(value: str) -> torch.dtype:
     raise ValueError(f"Unsupported QWEN_DTYPE: {value}")
 
 
-class VoiceDesignRequest(BaseModel):
-    text: str = Field(..., min_length=1)
-    instruct: str = Field(..., min_length=1)
-    language: str = "Auto"
+class GenerationParams(BaseModel):
     non_streaming_mode: bool = True
 
     do_sample: bool | None = None
@@ -46,7 +53,42 @@ class VoiceDesignRequest(BaseModel):
     subtalker_temperature: float | None = None
     max_new_tokens: int | None = None
 
-    response_format: Literal["base64", "wav"] = "base64"
+    def gen_kwargs(self) -> dict[str, object]:
+        gen_kwargs = {
+            "do_sample": self.do_sample,
+            "top_k": self.top_k,
+            "top_p": self.top_p,
+            "temperature": self.temperature,
+            "repetition_penalty": self.repetition_penalty,
+            "subtalker_dosample": self.subtalker_dosample,
+            "subtalker_top_k": self.subtalker_top_k,
+            "subtalker_top_p": self.subtalker_top_p,
+            "subtalker_temperature": self.subtalker_temperature,
+            "max_new_tokens": self.max_new_tokens,
+        }
+        return {k: v for k, v in gen_kwargs.items() if v is not None}
+
+    def batch_key(self) -> tuple:
+        """采样参数相同的请求才能放进同一次 generate"""
+        return (self.non_streaming_mode, tuple(sorted(self.gen_kwargs().items())))
+
+
+class VoiceDesignItem(BaseModel):
+    text: str = Field(..., min_length=1)
+    instruct: str = Field(..., min_length=1)
+    language: str = "Auto"
+
+
+class VoiceDesignRequest(VoiceDesignItem, GenerationParams):
+    # 默认直接返回音频二进制；base64 为兼容旧调用方保留，体积多 1/3
+    response_format: Literal["wav", "flac", "base64"] = "wav"
+
+
+class VoiceDesignBatchRequest(GenerationParams):
+    # 采样参数对整批生效
+    items: list[VoiceDesignItem] = Field(..., min_length=1)
+    # wav / flac：按条流式返回二进制帧（见 audio_utils.pack_frame）；base64：整批 JSON
+    response_format: Literal["wav", "flac", "base64"] = "wav"
 
 
 class AudioResponse(BaseModel):
@@ -55,12 +97,30 @@ class AudioResponse(BaseModel):
     mime_type: str = "audio/wav"
 
 
+class BatchItemResult(BaseModel):
+    index: int
+    sample_rate: int | None = None
+    audio_base64: str | None = None
+    mime_type: str = "audio/wav"
+    error: str | None = None
+
+
+class BatchResponse(BaseModel):
+    items: list[BatchItemResult]
+
+
 MODEL_NAME = os.getenv("QWEN_VOICE_DESIGN_MODEL", "Qwen/Qwen3-TTS-12Hz-1.7B-VoiceDesign")
 DEVICE = os.getenv("QWEN_DEVICE", "cuda:0" if torch.cuda.is_available() else "cpu")
 DEFAULT_DTYPE = "float32" if DEVICE.startswith("cpu") else "bfloat16"
 DTYPE = _parse_dtype(os.getenv("QWEN_DTYPE", DEFAULT_DTYPE))
 ATTN_IMPLEMENTATION = os.getenv("QWEN_ATTN_IMPLEMENTATION", "").strip()
 MODEL_LOCAL_FILES_ONLY = _parse_bool(os.getenv("QWEN_MODEL_LOCAL_FILES_ONLY"), default=False)
+# 一次 generate 的最大条数（微批调度与批量接口共用）
+MAX_BATCH_SIZE = max(int(os.getenv("QWEN_MAX_BATCH_SIZE", "16")), 1)
+# 微批窗口：第一条请求到达后最多等这么久再开跑，期间到达的请求合成一批
+BATCH_WINDOW_MS = max(float(os.getenv("QWEN_BATCH_WINDOW_MS", "20")), 0.0)
+# 一批的估算 codec token 上限，0 表示只按条数限制
+BATCH_MAX_TOKENS = max(int(os.getenv("QWEN_BATCH_MAX_TOKENS", "4096")), 0)
 
 app = FastAPI(title="Qwen3-TTS VoiceDesign API", version="1.0.0")
 _model_lock = threading.Lock()
@@ -92,39 +152,83 @@ def health() -> dict[str, str]:
     }
 
 
+def _run_batch(key: tuple, items: list[VoiceDesignItem]) -> list[tuple[np.ndarray, int]]:
+    """微批调度线程里执行：一次 generate 合成多条"""
+    assert _model is not None
+    (non_streaming_mode, gen_items), _bucket = key
+    with _model_lock:
+        wavs, sr = _model.generate_voice_design(
+            text=[item.text for item in items],
+            instruct=[item.instruct for item in items],
+            language=[item.language for item in items],
+            non_streaming_mode=non_streaming_mode,
+            **dict(gen_items),
+        )
+    return [(wav, sr) for wav in wavs]
+
+
+_batcher: MicroBatcher[VoiceDesignItem, tuple[np.ndarray, int]] = MicroBatcher(
+    _run_batch,
+    max_batch_size=MAX_BATCH_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+    max_tokens=BATCH_MAX_TOKENS,
+    name="voice-design-batcher",
+)
+
+
+def _submit(items: list[VoiceDesignItem], params: GenerationParams) -> list[Future]:
+    submissions = []
+    for item in items:
+        tokens = estimate_tokens(item.text, params.max_new_tokens)
+        submissions.append(((params.batch_key(), length_bucket(tokens)), item, tokens))
+    return _batcher.submit_many(submissions)
+
+
 @app.post("/v1/voice-design", response_model=AudioResponse)
 def generate_voice_design(request: VoiceDesignRequest):
     if _model is None:
         raise HTTPException(status_code=503, detail="Model not initialized yet")
 
-    gen_kwargs = {
-        "do_sample": request.do_sample,
-        "top_k": request.top_k,
-        "top_p": request.top_p,
-        "temperature": request.temperature,
-        "repetition_penalty": request.repetition_penalty,
-        "subtalker_dosample": request.subtalker_dosample,
-        "subtalker_top_k": request.subtalker_top_k,
-        "subtalker_top_p": request.subtalker_top_p,
-        "subtalker_temperature": request.subtalker_temperature,
-        "max_new_tokens": request.max_new_tokens,
-    }
-    gen_kwargs = {k: v for k, v in gen_kwargs.items() if v is not None}
-
     try:
-        with _model_lock:
-            wavs, sr = _model.generate_voice_design(
-                text=request.text,
-                instruct=request.instruct,
-                language=request.language,
-                non_streaming_mode=request.non_streaming_mode,
-                **gen_kwargs,
-            )
+        wav, sr = _submit([request], request)[0].result()
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Voice design failed: {exc}") from exc
 
-    audio_bytes = wav_to_bytes(wavs[0], sr)
-    if request.response_format == "wav":
-        return Response(content=audio_bytes, media_type="audio/wav")
+    if request.response_format == "base64":
+        return AudioResponse(sample_rate=sr, audio_base64=wav_bytes_to_base64(wav_to_bytes(wav, sr)))
+
+    return Response(
+        content=wav_to_bytes(wav, sr, request.response_format),
+        media_type=media_type_for(request.response_format),
+        headers={"X-Sample-Rate": str(sr)},
+    )
+
+
+def _batch_response(slots: list[Future | str], response_format: str):
+    outcomes = iter_outcomes(slots, "Voice design failed")
+    if response_format != "base64":
+        return StreamingResponse(audio_frames(outcomes, response_format), media_type=FRAMES_MEDIA_TYPE)
+
+    results = []
+    for index, result, error in outcomes:
+        if result is None:
+            results.append(BatchItemResult(index=index, error=error))
+            continue
+        wav, sr = result
+        results.append(
+            BatchItemResult(index=index, sample_rate=sr, audio_base64=wav_bytes_to_base64(wav_to_bytes(wav, sr)))
+        )
+    return BatchResponse(items=results)
+
+
+@app.post("/v1/voice-design/batch", response_model=BatchResponse)
+def generate_voice_design_batch(request: VoiceDesignBatchRequest):
+    """
+    一次请求合成多条，交给微批调度分组送进模型，结果与 items 顺序一致；整组失败时逐条重试，只有出错的条目带 error。
+    默认按条返回二进制帧，调用方可以边收边写盘。
+    """
+    if _model is None:
+        raise HTTPException(status_code=503, detail="Model not initialized yet")
+
+    return _batch_response(_submit(request.items, request), request.response_format)
 
-    return AudioResponse(sample_rate=sr, audio_base64=wav_bytes_to_base64(audio_bytes))
@@ -0,0 +1,129 @@
+"""
+分句流式输出：把长文本切成若干段，第一段单独生成尽快返回，其余段交给微批调度一起生成，
+按顺序以 16-bit PCM 分块写出。播放端拿到第一段就能开始播放，不必等整段生成完。
+"""
+
+from __future__ import annotations
+
+import re
+import struct
+from concurrent.futures import Future
+from typing import Callable, Iterator
+
+import numpy as np
+
+# 句末标点后切分；英文句号要求后面是空白 + 大写/数字，避免切开小数
+_SENTENCE_SPLIT = re.compile(r"(?<=[。！？!?；;…])\s*|(?<=\.)\s+(?=[A-Z0-9\"'“])")
+# 逗号/冒号夹在数字中间（3,000、10:30）时不切
+_CLAUSE_SPLIT = re.compile(r"(?<=[，、：])\s*|(?<=[,:])(?!\d)\s*")
+# 句号后面不是句子结束的缩写；单个大写字母（人名首字母 J. Smith）同样不切
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "jr", "sr", "mt", "vs", "e.g", "i.e", "u.s"}
+_WORD_BEFORE_DOT = re.compile(r"([A-Za-z][A-Za-z.]*)\.$")
+
+
+def _is_abbreviation(text: str, end: int) -> bool:
+    """text[:end] 以句号结尾时，判断句号前的词是否为缩写"""
+    match = _WORD_BEFORE_DOT.search(text, 0, end)
+    if not match:
+        return False
+    word = match.group(1)
+    return word.lower() in _ABBREVIATIONS or (len(word) == 1 and word.isupper())
+
+
+def _split(pattern: re.Pattern, text: str) -> list[str]:
+    """
+    按原文切成连续的片段，片段保留后面的空白，拼回去与原文一致；
+    只有空白的片段丢掉。中英文混排时不需要再猜该用什么分隔符拼接。
+    """
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        boundary = match.end()
+        if boundary <= start or boundary >= len(text):
+            continue
+        if text[match.start() - 1] == "." and _is_abbreviation(text, match.start()):
+            continue
+        pieces.append(text[start:boundary])
+        start = boundary
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece.strip()]
+
+
+def _length(piece: str) -> int:
+    return len(piece.strip())
+
+
+def split_text_chunks(text: str, first_chars: int, max_chars: int) -> list[str]:
+    """
+    第一段尽量短（不超过 first_chars，按句或逗号切），后面的句子合并到 max_chars 左右一段，
+    减少生成调用次数。单句超长时再按逗号切开。段内保留原文的空白，只去掉段首尾的空白。
+    """
+    pieces: list[str] = []
+    for sentence in _split(_SENTENCE_SPLIT, text):
+        if _length(sentence) > max_chars:
+            pieces.extend(_split(_CLAUSE_SPLIT, sentence))
+        else:
+            pieces.append(sentence)
+    if not pieces:
+        return [text.strip()]
+
+    first = pieces.pop(0)
+    if _length(first) > first_chars:
+        clauses = _split(_CLAUSE_SPLIT, first)
+        first = clauses.pop(0)
+        pieces[:0] = clauses
+    chunks = [first.strip()]
+
+    current = ""
+    for piece in pieces:
+        if current and _length(current) + _length(piece) > max_chars:
+            chunks.append(current.strip())
+            current = ""
+        current += piece
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
+
+
+def pcm16_bytes(wav: np.ndarray) -> bytes:
+    audio = np.asarray(wav, dtype=np.float32)
+    if audio.ndim > 1:
+        audio = np.squeeze(audio)
+    return (np.clip(audio, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def wav_stream_header(sample_rate: int, channels: int = 1, bits: int = 16) -> bytes:
+    """长度未知的 WAV 头：RIFF/data 长度写 0xFFFFFFFF，浏览器和 ffmpeg 都按流读取到结束"""
+    block_align = channels * bits // 8
+    return (
+        b"RIFF"
+        + struct.pack("<I", 0xFFFFFFFF)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+        + b"data"
+        + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+def stream_audio(
+    first: tuple[np.ndarray, int],
+    rest: list[Future],
+    audio_format: str,
+    on_error: Callable[[Exception], None],
+) -> Iterator[bytes]:
+    """first 为已生成的第一段 (wav, sr)，rest 为后续各段的 Future，按顺序输出"""
+    wav, sr = first
+    if audio_format == "wav":
+        yield wav_stream_header(sr)
+    yield pcm16_bytes(wav)
+    for index, future in enumerate(rest):
+        try:
+            wav, _ = future.result()
+        except Exception as exc:
+            # 响应头已经发出，只能提前结束流；剩下的段不再等待
+            on_error(exc)
+            for pending in rest[index + 1 :]:
+                pending.cancel()
+            return
+        yield pcm16_bytes(wav)
@@ -0,0 +1,110 @@
+import io
+import os
+import sys
+import json
+import time
+import wave
+import base64
+import struct
+import tempfile
+import argparse
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models_deploy"))
+
+# ================= 配置区域 =================
+
+SAMPLE_RATE = 24000
+LINE_SECONDS = 6.0     # 一句台词的典型时长
+NUM_LINES = 50
+CHUNK_SIZE = 64 * 1024  # 与 backend tts_client.CHUNK_SIZE 一致
+
+
+def make_wav_bytes(seconds):
+    """16-bit PCM WAV，与模型服务 wav_to_bytes 的输出格式相同"""
+    rng = np.random.default_rng(0)
+    pcm = (rng.standard_normal(int(SAMPLE_RATE * seconds)) * 3000).astype("<i2")
+    with io.BytesIO() as buffer:
+        with wave.open(buffer, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(pcm.tobytes())
+        return buffer.getvalue()
+
+
+try:
+    from services.audio_utils import pack_frame  # noqa: E402
+except ImportError:  # 没装 soundfile 时用同样的帧格式
+    def pack_frame(meta, payload):
+        header = json.dumps({**meta, "size": len(payload)}).encode("utf-8")
+        return struct.pack("<I", len(header)) + header + payload
+
+
+def base64_roundtrip(wav_bytes, path):
+    """旧方案：服务端 base64 + JSON，客户端整体解析、解码后写盘"""
+    body = json.dumps({"items": [{"index": 0, "sample_rate": SAMPLE_RATE,
+                                  "audio_base64": base64.b64encode(wav_bytes).decode("ascii")}]}).encode("utf-8")
+    item = json.loads(body)["items"][0]
+    with open(path, "wb") as f:
+        f.write(base64.b64decode(item["audio_base64"]))
+    return len(body)
+
+
+def binary_roundtrip(wav_bytes, path):
+    """新方案：服务端二进制帧，客户端按块读取并直接写盘"""
+    body = pack_frame({"index": 0, "sample_rate": SAMPLE_RATE, "mime_type": "audio/wav"}, wav_bytes)
+    view = memoryview(body)
+    header_len = struct.unpack("<I", view[:4])[0]
+    meta = json.loads(bytes(view[4:4 + header_len]))
+    offset = 4 + header_len
+    with open(path, "wb") as f:
+        end = offset + meta["size"]
+        while offset < end:
+            take = min(CHUNK_SIZE, end - offset)
+            f.write(view[offset:offset + take])
+            offset += take
+    return len(body)
+
+
+def measure(fn, wav_bytes, lines, path):
+    tracemalloc.start()
+    start = time.process_time()
+    size = 0
+    for _ in range(lines):
+        size = fn(wav_bytes, path)
+    cpu = (time.process_time() - start) / lines
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, cpu, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="base64 JSON vs 二进制帧 的单句传输开销")
+    parser.add_argument("--seconds", type=float, default=LINE_SECONDS)
+    parser.add_argument("--lines", type=int, default=NUM_LINES)
+    args = parser.parse_args()
+
+    wav_bytes = make_wav_bytes(args.seconds)
+    print("\n" + "=" * 60)
+    print(f"📦 {args.seconds:.1f}s line, WAV {len(wav_bytes) / 1024:.0f} KiB, {args.lines} rounds")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "line.wav")
+        results = {
+            "base64": measure(base64_roundtrip, wav_bytes, args.lines, path),
+            "binary": measure(binary_roundtrip, wav_bytes, args.lines, path),
+        }
+
+    for name, (size, cpu, peak) in results.items():
+        print(f"   {name:<7} body={size / 1024:7.0f} KiB  cpu/line={cpu * 1000:6.2f} ms  peak mem={peak / 1024:7.0f} KiB")
+
+    (b64_size, b64_cpu, b64_peak), (bin_size, bin_cpu, bin_peak) = results["base64"], results["binary"]
+    print(f"\n✅ body -{1 - bin_size / b64_size:.0%}, cpu -{1 - bin_cpu / b64_cpu:.0%}, "
+          f"peak mem -{1 - bin_peak / b64_peak:.0%} per line")
+
+
+if __name__ == "__main__":
+    main()
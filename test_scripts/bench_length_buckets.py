@@ -0,0 +1,112 @@
+import os
+import io
+import sys
+import time
+import base64
+import random
+import argparse
+import requests
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from workers.length_buckets import CODEC_FRAME_RATE, estimate_tokens, padding_ratio, plan_batches  # noqa: E402
+
+# ================= 配置区域 =================
+
+# models_deploy 中的 qwen-voice-clone 服务
+API_URL_BATCH = "http://localhost:8002/v1/voice-clone/batch"
+REF_AUDIO_PATH = "./ref.wav"
+REF_TEXT = "Okay. Yeah. I resent you. I love you."
+
+BATCH_LINES = 8     # 与 tts.qwen_api.batch_lines 一致
+NUM_LINES = 64
+SEED = 42
+
+# 长短混排的剧本：一句话的回应 + 大段旁白
+SHORT_LINES = ["嗯。", "好的。", "什么？", "走吧！", "不行。", "真的吗？", "等一下！", "谢谢你。"]
+LONG_LINE = (
+    "夜色渐深，城市的灯火在雨幕中晕开成一片模糊的光。他站在天台边缘，看着脚下川流不息的车灯，"
+    "想起多年前那个同样下着雨的夜晚，想起她离开时没有回头的背影，也想起自己当时说不出口的那句话。"
+)
+
+
+def build_script(num_lines, seed):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(num_lines):
+        roll = rng.random()
+        if roll < 0.5:
+            lines.append(rng.choice(SHORT_LINES))
+        elif roll < 0.8:
+            lines.append(LONG_LINE[: rng.randint(20, 60)])
+        else:
+            lines.append(LONG_LINE[: rng.randint(80, len(LONG_LINE))])
+    return lines
+
+
+def naive_batches(lines, size):
+    """按阅读顺序直接切批"""
+    return [lines[i:i + size] for i in range(0, len(lines), size)]
+
+
+def run_batches(batches, ref_b64):
+    """逐批请求服务，返回 (总耗时, 生成的 codec token 数)"""
+    total_tokens = 0
+    start = time.perf_counter()
+    for batch in batches:
+        payload = {
+            "voices": {"ref": {"ref_text": REF_TEXT, "ref_audio_base64": ref_b64}},
+            "items": [{"text": text, "voice_id": "ref"} for text in batch],
+        }
+        resp = requests.post(API_URL_BATCH, json=payload, timeout=600)
+        resp.raise_for_status()
+        for item in resp.json()["items"]:
+            if item.get("error"):
+                print(f"   ⚠️ item {item['index']}: {item['error']}")
+                continue
+            info = sf.info(io.BytesIO(base64.b64decode(item["audio_base64"])))
+            total_tokens += info.frames / info.samplerate * CODEC_FRAME_RATE
+    return time.perf_counter() - start, total_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="长度分桶 vs 阅读顺序的批量合成对比")
+    parser.add_argument("--dry-run", action="store_true", help="只比较估算的填充占比，不请求服务")
+    parser.add_argument("--lines", type=int, default=NUM_LINES)
+    parser.add_argument("--batch", type=int, default=BATCH_LINES)
+    args = parser.parse_args()
+
+    lines = build_script(args.lines, SEED)
+    strategies = {
+        "naive": naive_batches(lines, args.batch),
+        "bucketed": plan_batches(lines, args.batch, estimate_tokens),
+    }
+
+    print("\n" + "=" * 60)
+    print(f"📐 {len(lines)} lines, {args.batch} lines per batch")
+    print("=" * 60)
+    for name, batches in strategies.items():
+        print(f"   {name:<9} batches={len(batches):<3} estimated padding={padding_ratio(batches, estimate_tokens):.1%}")
+
+    if args.dry_run:
+        return
+
+    with open(REF_AUDIO_PATH, "rb") as f:
+        ref_b64 = base64.b64encode(f.read()).decode("ascii")
+
+    # 预热一次，避免把参考音编码和 CUDA 初始化算进第一种策略
+    run_batches([lines[:1]], ref_b64)
+
+    print("\n🚀 Benchmarking against", API_URL_BATCH)
+    results = {}
+    for name, batches in strategies.items():
+        elapsed, tokens = run_batches(batches, ref_b64)
+        results[name] = tokens / elapsed if elapsed else 0.0
+        print(f"   {name:<9} {elapsed:7.2f}s  {tokens:8.0f} tokens  {results[name]:7.1f} tokens/s")
+
+    if results.get("naive"):
+        print(f"\n✅ bucketed / naive throughput: {results['bucketed'] / results['naive']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()